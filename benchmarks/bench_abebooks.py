@@ -0,0 +1,87 @@
+"""
+Compare the targeted abebooks parser against parsing the whole page, failing if it is not
+at least --min-speedup times faster
+
+usage: python -m benchmarks.bench_abebooks [--repeat N] [--min-speedup RATIO]
+"""
+import re
+import sys
+import time
+import argparse
+from pathlib import Path
+import pandas as pd
+import tools.abebooks as abe
+from tools.webscraping import make_soup, get_parser_backend
+
+FIXTURE_PATH = Path(__file__).parent / 'fixtures' / 'abebooks.html'
+
+
+def parse_results_whole_page(content: bytes) -> pd.DataFrame:
+    """ the previous parser: whole-page tree and separate lookups per listing, kept as the baseline """
+    soup = make_soup(content)
+    results_block = soup.find('ul', class_='result-block', id='srp-results')
+
+    if not results_block:
+        return pd.DataFrame()
+
+    result_items = []
+    for x in results_block.find_all('li', attrs={'data-cy': 'listing-item'}):
+        metadata = {y.get('itemprop'): y.get('content') for y in x.find_all('meta')}
+        currency = metadata['priceCurrency']
+        shipping_details = x.find('a', class_='item-shipping-dest').getText().strip()
+        shipping_cost_raw = x.find('span', class_='item-shipping').getText()
+        shipping_cost, shipping_currency = abe.parse_displayed_price(shipping_cost_raw, default_currency=currency)
+        seller_raw = x.find('div', class_='bookseller-info').getText()
+        seller = re.sub(r'^\s+Seller:\s+(.*?)\n.*', r'\1', seller_raw, flags=re.DOTALL)
+        result_items.append(metadata | {
+            "seller": seller,
+            "shipping_details": shipping_details,
+            "shipping_cost": shipping_cost,
+            "shipping_currency": shipping_currency,
+        })
+
+    return (pd
+        .DataFrame(result_items)
+        .fillna('')
+        .rename(columns={
+            "name": "title",
+            "datePublished": "date_published",
+            "priceCurrency": "currency",
+            "itemCondition": "condition",
+            "bookEdition": "edition",
+            "bookFormat": "binding",
+        })
+        .assign(condition = lambda t: t.about.apply(abe.get_condition_description))
+        .convert_dtypes()
+        .astype({'price': 'float', 'shipping_cost': 'float'})
+    )
+
+
+def time_parser(parser, content: bytes, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parser(content)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--min-speedup', type=float, default=1.5, help='how many times faster than the whole page parse the targeted one must be')
+    args = parser.parse_args()
+
+    content = FIXTURE_PATH.read_bytes()
+    pd.testing.assert_frame_equal(abe.parse_results(content).drop(columns='issues'), parse_results_whole_page(content))
+
+    whole_page = time_parser(parse_results_whole_page, content, args.repeat)
+    targeted = time_parser(abe.parse_results, content, args.repeat)
+    listings = len(abe.parse_results(content))
+    print(f'{listings} listings, {len(content) / 1024:.0f} KiB, {get_parser_backend()} backend')
+    print(f'whole page: {whole_page * 1000:7.1f} ms')
+    print(f'targeted:   {targeted * 1000:7.1f} ms  ({whole_page / targeted:.1f}x)')
+    if whole_page / targeted < args.min_speedup:
+        sys.exit(f'the targeted parser is less than {args.min_speedup:g}x faster than the whole page parse')
+
+
+if __name__ == '__main__':
+    main()
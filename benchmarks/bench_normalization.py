@@ -0,0 +1,94 @@
+"""
+Compare expanding nested records with explode_records against .explode().apply(pd.Series)
+on generated Google Books identifiers and Bibliocommons formats
+
+usage: python -m benchmarks.bench_normalization [--records N] [--repeat N]
+"""
+import time
+import random
+import argparse
+import pandas as pd
+from tools.webscraping import explode_records
+
+
+def make_industry_identifiers(num_records: int) -> pd.Series:
+    """ like the Google Books 'industryIdentifiers' column: isbns for most volumes, nothing for some """
+    rng = random.Random(0)
+    types = ['ISBN_10', 'ISBN_13', 'OTHER']
+    return pd.Series([
+        [{'type': x, 'identifier': str(rng.randrange(10 ** 12, 10 ** 13))} for x in rng.sample(types, rng.randint(1, 3))]
+        if rng.random() > 0.1 else None
+        for _ in range(num_records)
+    ], name='industryIdentifiers')
+
+
+def make_formats(num_records: int) -> pd.Series:
+    """ like the 'formats' column of parsed Bibliocommons results """
+    rng = random.Random(0)
+    return pd.Series([
+        [{
+            'format_description': rng.choice(['Book', 'eBook', 'Downloadable Audiobook']),
+            'availability_status': rng.choice(['Available', 'All copies in use']),
+            'call_number': f'FIC {rng.randrange(1000)}',
+            'hold_counts': f'Holds: {rng.randrange(50)} on {rng.randrange(1, 20)} copies',
+            'eresource_link': '',
+        } for _ in range(rng.randint(1, 3))]
+        for _ in range(num_records)
+    ], name='formats')
+
+
+def expand_isbns_legacy(industry_identifiers: pd.Series) -> pd.DataFrame:
+    """ the previous clean_search_results expansion, kept as the baseline """
+    return (industry_identifiers
+        .dropna()
+        .explode()
+        .apply(pd.Series)
+        [['type', 'identifier']]
+        .set_index('type', append=True)
+        .unstack()['identifier']
+        .astype('string')
+        .rename(columns=str.lower)
+    )
+
+
+def expand_isbns(industry_identifiers: pd.Series) -> pd.DataFrame:
+    """ the clean_search_results expansion """
+    return (industry_identifiers
+        .dropna()
+        .pipe(explode_records)
+        .reindex(columns=['type', 'identifier'])
+        .dropna(subset=['type'])
+        .set_index('type', append=True)
+        .unstack()['identifier']
+        .astype('string')
+        .rename(columns=str.lower)
+    )
+
+
+def time_function(function, data, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(data)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    cases = [
+        ('google books isbns', make_industry_identifiers(args.records), expand_isbns_legacy, expand_isbns),
+        ('bibliocommons formats', make_formats(args.records), lambda x: x.explode().apply(pd.Series), explode_records),
+    ]
+    print(f'{args.records} records')
+    for name, data, legacy, vectorized in cases:
+        pd.testing.assert_frame_equal(legacy(data), vectorized(data))
+        legacy_time = time_function(legacy, data, args.repeat)
+        vectorized_time = time_function(vectorized, data, args.repeat)
+        print(f'{name:22} apply(pd.Series): {legacy_time * 1000:7.1f} ms   explode_records: {vectorized_time * 1000:7.1f} ms  ({legacy_time / vectorized_time:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Compare parsing the recorded pages in the fetch threads against the parse process pool
+with a growing number of workers, checking both give the same frames
+
+usage: python -m benchmarks.bench_parse_pool [--pages N] [--threads N] [--workers 1 2 4 ...]
+"""
+import os
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import tools.sources as sources
+
+FIXTURES_DIR = Path(__file__).parent / 'fixtures'
+
+# registered source and its recorded page
+PAGES = {
+    'goodreads': 'goodreads.html',
+    'abebooks': 'abebooks.html',
+    'library': 'bibliocommons.html',
+    'annas': 'annas_archive.html',
+}
+
+
+def parse_pages(pages: list, threads: int) -> float:
+    """ pages parsed per second by `threads` threads standing in for the fetch threads """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda x: sources.parse_content_in_pool(*x), pages))
+    return len(pages) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    contents = {source: (FIXTURES_DIR / fixture).read_bytes() for source, fixture in PAGES.items()}
+    pages = [(source, contents[source]) for source in list(PAGES) * (args.pages // len(PAGES))]
+
+    sources.configure_parse_pool(max(args.workers))
+    for source, content in contents.items():
+        pd.testing.assert_frame_equal(sources.parse_content_in_pool(source, content), sources.parse_content(source, content))
+
+    sources.configure_parse_pool(0)
+    in_threads = parse_pages(pages, args.threads)
+    print(f'{len(pages)} pages, {args.threads} threads, {os.cpu_count()} cpus')
+    print(f'in threads:     {in_threads:7.1f} pages/s')
+    for workers in args.workers:
+        sources.configure_parse_pool(workers)
+        parse_pages(pages[:workers * 2], args.threads) # start the workers and import the parsers
+        pooled = parse_pages(pages, args.threads)
+        print(f'{workers:2} processes:   {pooled:7.1f} pages/s  ({pooled / in_threads:.1f}x)')
+    sources.configure_parse_pool(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Measure every parser and formatter on the recorded pages: parse throughput (pages/sec and
+rows/sec), peak memory while parsing and the time of each booksearch.format_results_*.
+Results are written as json so runs from different commits can be compared.
+
+usage: python -m benchmarks.suite [--repeat N] [--output FILE] [--compare BASELINE] [--threshold RATIO]
+"""
+import sys
+import json
+import time
+import platform
+import argparse
+import importlib
+import statistics
+import subprocess
+import tracemalloc
+from pathlib import Path
+import booksearch
+from tools.currency import configure_rate_provider
+from tools.webscraping import get_parser_backend
+
+FIXTURES_DIR = Path(__file__).parent / 'fixtures'
+
+# parser module, recorded page, the booksearch formatter of the source and a search url to pass it
+BENCHMARKS = {
+    'goodreads': ('tools.goodreads', 'goodreads.html', 'format_results_goodreads', 'https://www.goodreads.com/search?q=dune'),
+    'abebooks': ('tools.abebooks', 'abebooks.html', 'format_results_abebooks', 'https://www.abebooks.com/servlet/SearchResults?tn=dune'),
+    'bibliocommons': ('tools.bibliocommons', 'bibliocommons.html', 'format_results_bibliocommons', 'https://epl.bibliocommons.com/v2/search?query=dune'),
+    'annas_archive': ('tools.annas_archive', 'annas_archive.html', 'format_results_annas_archive', 'https://annas-archive.org/search?q=dune'),
+    'google_books': ('tools.google_books', 'google_books.json', None, None),
+    'indigo': ('tools.indigo', 'indigo.html', None, None),
+    'kobo': ('tools.kobo', 'kobo.html', None, None),
+}
+
+DEFAULT_OUTPUT = Path(__file__).parent / 'benchmark_results.json'
+DEFAULT_THRESHOLD = 1.2 # how many times slower (or bigger) than the baseline counts as a regression
+
+
+def time_call(function, repeat: int) -> float:
+    """ median seconds per call """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def measure_peak_memory(function) -> int:
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmark(module: str, fixture: str, formatter: str, search_url: str, repeat: int) -> dict:
+    parse_results = importlib.import_module(module).parse_results
+    content = (FIXTURES_DIR / fixture).read_bytes()
+    df_results = parse_results(content)
+
+    parse_seconds = time_call(lambda: parse_results(content), repeat)
+    result = {
+        'fixture_bytes': len(content),
+        'rows': len(df_results),
+        'parse_seconds': parse_seconds,
+        'pages_per_second': 1 / parse_seconds,
+        'rows_per_second': len(df_results) / parse_seconds,
+        'parse_peak_memory_bytes': measure_peak_memory(lambda: parse_results(content)),
+    }
+    if formatter:
+        format_results = getattr(booksearch, formatter)
+        result['format_seconds'] = time_call(lambda: format_results(df_results, search_url), repeat)
+    return result
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """ print each measurement against the baseline and return the ones that regressed """
+    regressions = []
+    for source, measurements in results['benchmarks'].items():
+        baseline_measurements = baseline['benchmarks'].get(source, {})
+        for name in ('parse_seconds', 'parse_peak_memory_bytes', 'format_seconds'):
+            if name not in measurements or not baseline_measurements.get(name):
+                continue
+            ratio = measurements[name] / baseline_measurements[name]
+            flag = ' REGRESSION' if ratio > threshold else ''
+            print(f'{source:<15} {name:<25} {ratio:6.2f}x baseline{flag}')
+            if flag:
+                regressions.append((source, name, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', '-o', default=DEFAULT_OUTPUT, help='json file to write the results to')
+    parser.add_argument('--compare', help='results json of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='ratio to the baseline that counts as a regression')
+    parser.add_argument('--sources', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    args = parser.parse_args()
+
+    # fixed rates so the abebooks formatter never goes to the network
+    configure_rate_provider('CAD', path=FIXTURES_DIR / 'rates.json', ttl=float('inf'))
+
+    results = {
+        'commit': get_commit(),
+        'created_at': time.time(),
+        'python': platform.python_version(),
+        'parser_backend': get_parser_backend(),
+        'repeat': args.repeat,
+        'benchmarks': {},
+    }
+    for source in args.sources:
+        result = run_benchmark(*BENCHMARKS[source], repeat=args.repeat)
+        results['benchmarks'][source] = result
+        format_time = f"  format {result['format_seconds'] * 1000:8.2f} ms" if 'format_seconds' in result else ''
+        print(f"{source:<15} {result['rows']:5} rows  parse {result['parse_seconds'] * 1000:8.2f} ms  "
+              f"{result['pages_per_second']:7.1f} pages/s  {result['rows_per_second']:9.0f} rows/s  "
+              f"peak {result['parse_peak_memory_bytes'] / 1024 / 1024:6.1f} MiB{format_time}")
+
+    Path(args.output).write_text(json.dumps(results, indent=2))
+    print(f'results written to {args.output}')
+
+    if args.compare:
+        regressions = compare(results, json.loads(Path(args.compare).read_text()), args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,75 +10,585 @@
 # TODO: add more language details and search optionality
 # TODO: split up the CPL and EPL again perhaps
 # TODO: create a 'summary string' for each source e.g. 'abe: $10 (soft), $15 (hard), 56 copies. Edmonton: Bookseller ($15)' or something 
+from __future__ import annotations
+import os
+import sys
+import json
 import argparse
-import requests
-import tabulate
-import tools.bibliocommons as biblio
-import tools.abebooks as abe
-import tools.annas_archive as annas
-import tools.goodreads as goodreads
-import numpy as np
-import pandas as pd
-
-from forex_python.converter import CurrencyRates
-USD_TO_CAD_FACTOR = CurrencyRates().get_rate('USD', 'CAD')
+import time
+import threading
+from typing import TYPE_CHECKING
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+import tools.sources as sources
+import tools.metrics as metrics
+from tools.scheduler import FetchError
+
+# pandas, numpy, tabulate and the source modules are imported where they are used so that
+# --help and single-source searches only pay for what they need
+if TYPE_CHECKING:
+    import pandas as pd
+
+DEFAULT_TIMEOUT_SECONDS = 30
+PARSER_BACKENDS = ['lxml', 'html.parser'] # the backends tools.webscraping knows, fastest first
 
 def main():
-    parser = argparse.ArgumentParser()
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
+
+    parser = argparse.ArgumentParser(epilog=f'other commands: {", ".join(COMMANDS)} (see booksearch <command> --help)')
     parser.add_argument('--title', '-t', nargs='+', default=[])
     parser.add_argument('--author', '-a')
-    parser.add_argument('--max_num_results', '-n', type=int)
-    parser.add_argument('--sources', '-s', nargs='+')
+    parser.add_argument('--max_num_results', '-n', type=int, help="most results to show per source (abebooks fetches only the site's first N by its own total price, before CAD conversion and local shipping re-sort them, so they can differ from the first N of a full search)")
+    parser.add_argument('--max-price', type=float, help='highest total price (CAD) of listings to fetch from sources that page through results')
+    parser.add_argument('--sources', '-s', nargs='+', choices=sources.list_sources())
+    parser.add_argument('--libraries', '-l', nargs='+', type=library_subdomain, help='bibliocommons subdomains to search (default: every registered library)')
+    parser.add_argument('--concurrency', '-c', type=int, help='number of sources to fetch at once (default: all of them)')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT_SECONDS, help='seconds to wait on each source before giving up')
+    parser.add_argument('--stream', action='store_true', help='print each source as soon as it finishes, then list the ones with nothing to show')
+    parser.add_argument('--no-cache', action='store_true', help='neither read from nor write to the response cache')
+    parser.add_argument('--refresh', action='store_true', help='ignore cached responses but store the new ones')
+    parser.add_argument('--offline', action='store_true', help='answer from previously stored results without using the network')
+    parser.add_argument('--no-store', action='store_true', help="don't keep results in the local result store")
+    parser.add_argument('--archive', action='store_true', help='keep the raw responses in the response archive so `booksearch reparse` can parse them again')
+    parser.add_argument('--parser', choices=PARSER_BACKENDS, help='html parser backend (default: fastest installed)')
+    parser.add_argument('--timings', action='store_true', help='report the time spent fetching, parsing and formatting each source')
+    parser.add_argument('--metrics', help='json lines file that the metrics of every search url are appended to')
+    parser.add_argument('--import-profile', action='store_true', help='report the time spent importing each module')
+    parser.add_argument('--server', default=os.environ.get('BOOKSEARCH_SERVER'), help='url of a running `booksearch serve` to send the search to (default: $BOOKSEARCH_SERVER)')
     args = parser.parse_args()
 
+    if args.server:
+        # these change how this process searches, which a server does as it was started
+        local_options = [f"--{x.replace('_', '-')}" for x in ('stream', 'no_cache', 'refresh', 'archive', 'parser', 'timings', 'metrics', 'import_profile') if getattr(args, x)]
+        if local_options:
+            parser.error(f"{', '.join(local_options)} can't be used with --server (pass the cache, parser and archive options to `booksearch serve` instead)")
+        search_on_server(args)
+    elif args.import_profile:
+        from tools.importprofile import ImportProfiler
+        with ImportProfiler() as profiler:
+            search(args)
+        print('\n' + profiler.report())
+    else:
+        search(args)
+
+
+def batch_main(argv: list) -> None:
+    parser = argparse.ArgumentParser(prog='booksearch batch', description='search every source for a list of books, resuming from a checkpoint')
+    parser.add_argument('input', help='csv with title and author columns, or a goodreads library export')
+    parser.add_argument('--shelves', nargs='+', help='only search books on these goodreads shelves')
+    parser.add_argument('--sources', '-s', nargs='+', choices=sources.list_sources())
+    parser.add_argument('--output', '-o', default='batch_results.jsonl', help='json lines file that results are appended to')
+    parser.add_argument('--checkpoint', help='file of finished searches (default: <output>.checkpoint)')
+    parser.add_argument('--concurrency', '-c', type=int, default=4, help='number of searches to run at once')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT_SECONDS, help='seconds to wait on each request')
+    parser.add_argument('--no-cache', action='store_true', help='neither read from nor write to the response cache')
+    parser.add_argument('--archive', action='store_true', help='keep the raw responses in the response archive so `booksearch reparse` can parse them again')
+    parser.add_argument('--metrics', help='json lines file that the metrics of every search url are appended to')
+    parser.add_argument('--timings', action='store_true', help='report the time spent fetching and parsing each source at the end')
+    parser.add_argument('--parse-workers', '-p', type=int, default=0, help='processes to parse pages in, fed by the --concurrency fetch threads (default: parse in the fetch threads)')
+    args = parser.parse_args(argv)
+
+    from tools.batch import read_queries, run_batch
+    from tools.cache import configure_cache
+    from tools.archive import configure_archive
+    configure_cache(enabled=not args.no_cache)
+    configure_archive(enabled=args.archive)
+    recorder = metrics.configure_metrics(enabled=bool(args.timings or args.metrics), path=args.metrics)
+    sources.configure_parse_pool(args.parse_workers)
+
+    try:
+        run_batch(
+            read_queries(args.input, shelves=args.shelves),
+            args.sources or sources.list_sources(),
+            output_path=args.output,
+            checkpoint_path=args.checkpoint or args.output + '.checkpoint',
+            concurrency=args.concurrency,
+            timeout=args.timeout,
+        )
+    finally:
+        sources.configure_parse_pool(0)
+    if args.timings:
+        print(stringify_table(recorder.get_summary().round(3)))
+
+
+def toread_main(argv: list) -> None:
+    parser = argparse.ArgumentParser(prog='booksearch toread', description='check only new or stale shelved goodreads books')
+    parser.add_argument('export', help='goodreads library export csv')
+    parser.add_argument('--shelves', nargs='+', default=['to-read', 'own', 'own-epub'])
+    parser.add_argument('--sources', '-s', nargs='+', choices=sources.list_sources(), default=['library'])
+    parser.add_argument('--libraries', '-l', nargs='+', type=library_subdomain, help='bibliocommons subdomains to search (default: every registered library)')
+    parser.add_argument('--state', help='state database (default: in the booksearch data directory)')
+    parser.add_argument('--max-age', type=float, help='hours before any check is stale (default: per source)')
+    parser.add_argument('--concurrency', '-c', type=int, default=4, help='number of searches to run at once')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT_SECONDS, help='seconds to wait on each request')
+    args = parser.parse_args(argv)
+
+    from tools.toread import ToReadState, STATE_PATH, refresh
+    if args.libraries:
+        from tools.bibliocommons import set_libraries
+        set_libraries(args.libraries)
+    state = ToReadState(args.state or STATE_PATH)
+    refresh(
+        args.export,
+        args.sources,
+        state,
+        shelves=args.shelves,
+        max_age_seconds=args.max_age * 3600 if args.max_age else None,
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+    )
+    print(stringify_table(state.get_summary()))
+
+
+def watch_main(argv: list) -> None:
+    parser = argparse.ArgumentParser(prog='booksearch watch', description='poll library holds for a list of books, reporting only what changed')
+    parser.add_argument('watchlist', help='csv with title and author columns, or a goodreads library export')
+    parser.add_argument('--libraries', '-l', nargs='+', type=library_subdomain, help='bibliocommons subdomains to check (default: every registered library)')
+    parser.add_argument('--interval', type=float, default=60, help='minutes between checks')
+    parser.add_argument('--once', action='store_true', help='check once and exit')
+    parser.add_argument('--state', help='state database (default: in the booksearch data directory)')
+    parser.add_argument('--concurrency', '-c', type=int, default=8, help='number of pages to check at once')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT_SECONDS, help='seconds to wait on each request')
+    args = parser.parse_args(argv)
+
+    from tools.watch import WatchState, STATE_PATH, watch
+    rounds = watch(
+        args.watchlist,
+        WatchState(args.state or STATE_PATH),
+        libraries=args.libraries,
+        interval_seconds=args.interval * 60,
+        rounds=1 if args.once else None,
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+    )
+    import pandas as pd
+    try:
+        for df_changes in rounds:
+            # a round that can't be reported is skipped rather than ending the watch
+            try:
+                print(time.strftime('%Y-%m-%d %H:%M'), f'{len(df_changes)} changes')
+                if not df_changes.empty:
+                    df_changes = df_changes.assign(
+                        title = lambda t: t['title'].str[:30],
+                        author = lambda t: t['author'].str[:15],
+                        wait_days = lambda t: pd.to_numeric(t['wait_days'], errors='coerce').round(),
+                    )
+                    print(stringify_table(df_changes) + '\n', flush=True)
+            except Exception as e:
+                print(f'could not report the changes of this round: {e!r}', file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+
+
+def works_main(argv: list) -> None:
+    parser = argparse.ArgumentParser(prog='booksearch works', description='group batch results from every source into works, one row each')
+    parser.add_argument('input', help='json lines results of booksearch batch')
+    parser.add_argument('--output', '-o', help='csv to write the works to instead of printing them')
+    parser.add_argument('--threshold', type=float, default=0.8, help='share of title words two titles in the same block need in common to match')
+    args = parser.parse_args(argv)
+
+    import pandas as pd
+    from tools.resolution import resolve_works, summarize_works
+    from tools.currency import get_rate_provider
+
+    try:
+        to_cad_factors = get_rate_provider('CAD').get_conversion_factors()
+    except RuntimeError as e:
+        print(f'prices are not compared: {e}', file=sys.stderr)
+        to_cad_factors = None
+
+    df_results = pd.read_json(args.input, lines=True, dtype={'isbn': 'string', 'isbn_10': 'string', 'isbn_13': 'string'})
+    df_works = summarize_works(resolve_works(df_results, similarity_threshold=args.threshold), to_cad_factors=to_cad_factors)
+    print(f'{len(df_results)} rows from {df_results.source.nunique()} sources are {len(df_works)} works', file=sys.stderr)
+    if args.output:
+        df_works.to_csv(args.output, index=False)
+    else:
+        print(stringify_table(df_works.drop(columns=['work_id', 'isbn13']).assign(
+            title = lambda t: t['title'].str[:30],
+            author = lambda t: t['author'].str[:20],
+        ).astype('object').fillna('')))
+
+
+def serve_main(argv: list) -> None:
+    parser = argparse.ArgumentParser(prog='booksearch serve', description='answer searches over http, keeping connections, caches and exchange rates warm')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--libraries', '-l', nargs='+', type=library_subdomain, help='bibliocommons subdomains to search (default: every registered library)')
+    parser.add_argument('--concurrency', '-c', type=int, help='number of sources to fetch at once per search (default: all of them)')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT_SECONDS, help='seconds to wait on each source unless a search sets its own')
+    parser.add_argument('--no-cache', action='store_true', help='neither read from nor write to the response cache')
+    parser.add_argument('--no-store', action='store_true', help="don't keep results in the local result store")
+    parser.add_argument('--archive', action='store_true', help='keep the raw responses in the response archive so `booksearch reparse` can parse them again')
+    parser.add_argument('--parser', choices=PARSER_BACKENDS, help='html parser backend (default: fastest installed)')
+    parser.add_argument('--quiet', '-q', action='store_true', help="don't log each request")
+    args = parser.parse_args(argv)
+
+    from tools.cache import configure_cache
+    from tools.store import configure_store
+    from tools.webscraping import set_parser_backend
+    from tools.server import serve
+    from tools.archive import configure_archive
+    configure_cache(enabled=not args.no_cache)
+    configure_store(enabled=not args.no_store)
+    configure_archive(enabled=args.archive)
+    set_parser_backend(args.parser)
+    if args.libraries:
+        from tools.bibliocommons import set_libraries
+        set_libraries(args.libraries)
+    warm_up()
+
+    serve(
+        lambda request: search_request(request, concurrency=args.concurrency, timeout=args.timeout),
+        sources.list_sources,
+        host=args.host,
+        port=args.port,
+        quiet=args.quiet,
+    )
+
+
+def reparse_main(argv: list) -> None:
+    parser = argparse.ArgumentParser(prog='booksearch reparse', description='parse archived responses again with the current parsers, without the network')
+    parser.add_argument('--sources', '-s', nargs='+', choices=sources.list_sources())
+    parser.add_argument('--force', action='store_true', help='parse every archived response again, not only those read by an older parser version')
+    parser.add_argument('--concurrency', '-c', type=int, default=8, help='number of search urls to parse at once')
+    parser.add_argument('--parse-workers', '-p', type=int, default=os.cpu_count(), help='processes to parse pages in (0 to parse in the --concurrency threads)')
+    parser.add_argument('--parser', choices=PARSER_BACKENDS, help='html parser backend (default: fastest installed)')
+    args = parser.parse_args(argv)
+
+    from tools.archive import ResponseArchive, reparse
+    from tools.webscraping import set_parser_backend
+    set_parser_backend(args.parser)
+    sources.configure_parse_pool(args.parse_workers)
+
+    start = time.perf_counter()
+    try:
+        df_summary = reparse(ResponseArchive(), sources=args.sources, force=args.force, concurrency=args.concurrency)
+    finally:
+        sources.configure_parse_pool(0)
+    print(stringify_table(df_summary))
+    print(f'reparsed {df_summary.searches.sum()} search urls in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+
+
+def warm_up() -> None:
+    """ import everything a search uses and load the exchange rates before the first search arrives """
+    import pandas, tabulate
+    for source in sources.list_sources():
+        sources.load_source_module(source)
+    try:
+        from tools.currency import get_rate_provider
+        get_rate_provider('CAD').get_rates()
+    except RuntimeError as e:
+        print(f'exchange rates are not loaded yet: {e}', file=sys.stderr)
+
+
+def search_request(request: dict, concurrency: int=None, timeout: float=None) -> tuple:
+    """ run a search sent to the server, returning the json response and the time it can be reused until """
+    from tools.cache import get_ttl
+
+    selected = request.get('sources') or sources.list_sources()
+    unknown = set(selected) - set(sources.list_sources())
+    if unknown:
+        raise ValueError(f'unknown sources {sorted(unknown)}, choose from {sources.list_sources()}')
+
+    query = sources.join_query(request.get('title'), request.get('author'))
+    if request.get('offline'):
+        sources_results = search_offline(query, selected)
+    else:
+        selected_sources = [
+            {
+                "source": source,
+                "urls": compose_request_urls(source, request),
+            }
+            for source in selected
+        ]
+        limits = {'max_results': request.get('max_results'), 'max_price': request.get('max_price')}
+        sources_results = run_sources(selected_sources, query=query, title=request.get('title'), author=request.get('author'), limits=limits, concurrency=concurrency, timeout=request.get('timeout', timeout))
+
+    response = {
+        'query': query,
+        'sources': [
+            {
+                'source': x['source'],
+                'urls': x['urls'],
+                'status': get_status(x['df']),
+            } | json.loads(x['df'].head(request.get('max_results')).to_json(orient='split', index=False))
+            for x in sources_results
+        ],
+    }
+    # a search with a failed source is not reused, so the next one tries again
+    reusable = not request.get('offline') and not any(x['status'] for x in response['sources'])
+    expires_at = time.time() + min((get_ttl(url) for x in sources_results for url in x['urls']), default=0) if reusable else time.time()
+    return response, expires_at
+
+
+def compose_request_urls(source: str, request: dict) -> list:
+    """ the search urls of a source for a request, searching the libraries it names rather than the server's """
+    if source == 'library' and request.get('libraries'):
+        from tools.bibliocommons import compose_search_urls, SUBDOMAIN_PATTERN
+        invalid = [x for x in request['libraries'] if not SUBDOMAIN_PATTERN.fullmatch(x)]
+        if invalid:
+            raise ValueError(f'{invalid} are not bibliocommons subdomains')
+        return compose_search_urls(title=request.get('title'), author=request.get('author'), libraries=request['libraries'])
+    return sources.compose_search_urls(source, title=request.get('title'), author=request.get('author'))
+
+
+def library_subdomain(value: str) -> str:
+    """ argparse type of --libraries """
+    from tools.bibliocommons import SUBDOMAIN_PATTERN
+    if not SUBDOMAIN_PATTERN.fullmatch(value):
+        raise argparse.ArgumentTypeError(f'{value} is not a bibliocommons subdomain')
+    return value
+
+
+def search_on_server(args: argparse.Namespace) -> None:
+    """ the thin client: send the search to a running server and print its tables """
+    import tabulate
+    from tools.server import query_server
+
+    request = {
+        'title': ' '.join(args.title),
+        'author': args.author,
+        'sources': args.sources,
+        'libraries': args.libraries,
+        'max_results': args.max_num_results,
+        'max_price': args.max_price,
+        'timeout': args.timeout,
+        'offline': args.offline,
+    }
+    response = query_server(args.server, request, timeout=args.timeout * 2 if args.timeout else None)
+    for x in response['sources']:
+        if x['data']:
+            table = tabulate.tabulate(x['data'], headers=x['columns'])
+            print('\n' + x['source'].upper() + '\n' + '\n'.join(x['urls']) + '\n\n' + table + '\n')
+
+
+def search(args: argparse.Namespace) -> None:
+    from tools.cache import configure_cache
+    from tools.store import configure_store
+    from tools.archive import configure_archive
+    from tools.webscraping import set_parser_backend
+    configure_cache(enabled=not args.no_cache, refresh=args.refresh)
+    configure_store(enabled=not args.no_store)
+    configure_archive(enabled=args.archive)
+    set_parser_backend(args.parser)
+    recorder = metrics.configure_metrics(enabled=bool(args.timings or args.metrics), path=args.metrics)
+    if args.libraries:
+        from tools.bibliocommons import set_libraries
+        set_libraries(args.libraries)
+
     title_joined = ' '.join(args.title)
-    query = ' '.join(x for x in (title_joined, args.author) if x)
-
-    search_url_goodreads = goodreads.compose_search_url(query = query)
-    search_url_abebooks = abe.compose_search_url(title=title_joined, author=args.author)
-    search_url_annas_archive = annas.compose_search_url(query=query)
-    search_urls_library = [biblio.generate_compose_search_url_function(library)(title=title_joined, author=args.author) 
-                   for library in ('epl', 'calgary')]
-
-    sources = [
-        {
-            "source": "goodreads", 
-            "parser": format_results_goodreads, 
-            "url": search_url_goodreads
-        },
-        {
-            "source": "abebooks", 
-            "parser": format_results_abebooks, 
-            "url": search_url_abebooks
-        },
-        {
-            "source": "library", 
-            "parser": format_results_bibliocommons, 
-            "url": search_urls_library
-        },
-        {
-            "source": "annas", 
-            "parser": format_results_annas_archive, 
-            "url": search_url_annas_archive
-        },
-    ]
-    selected_sources = [x for x in sources if x['source'] in user_sources] if (user_sources := args.sources) else sources
-    sources_results = [x | {'df': x['parser'](x['url'])} for x in selected_sources]
-    sources_results_notempty = [x for x in sources_results if not x['df'].empty]
-    for x in sources_results_notempty:
-        source = x['source'].upper()
-        url = u if isinstance((u := x['url']), str) else '\n'.join(u)
-        df = stringify_table(x['df'].head(args.max_num_results))
-        print('\n' + source + '\n' + url + '\n\n' +  df + '\n')
+    query = sources.join_query(title_joined, args.author)
+    if args.offline:
+        sources_results = search_offline(query, args.sources or sources.list_sources())
+    else:
+        selected_sources = [
+            {
+                "source": source,
+                "urls": sources.compose_search_urls(source, title=title_joined, author=args.author),
+            }
+            for source in (args.sources or sources.list_sources())
+        ]
+        limits = {'max_results': args.max_num_results, 'max_price': args.max_price}
+        if args.stream:
+            sources_results = stream_sources(selected_sources, query=query, title=title_joined, author=args.author, limits=limits, concurrency=args.concurrency, timeout=args.timeout, max_num_results=args.max_num_results)
+        else:
+            sources_results = run_sources(selected_sources, query=query, title=title_joined, author=args.author, limits=limits, concurrency=args.concurrency, timeout=args.timeout)
+    if not args.stream or args.offline:
+        for x in sources_results:
+            if not x['df'].empty:
+                print_source_results(x, args.max_num_results)
+    if args.timings:
+        print('TIMINGS\n\n' + stringify_table(recorder.get_summary().round(3)) + '\n')
+
+
+def print_source_results(source_results: dict, max_num_results: int=None) -> None:
+    source = source_results['source'].upper()
+    url = '\n'.join(source_results['urls'])
+    df = stringify_table(source_results['df'].head(max_num_results))
+    print('\n' + source + '\n' + url + '\n\n' +  df + '\n', flush=True)
+
+
+def stream_sources(sources: list, query: str=None, title: str=None, author: str=None, limits: dict=None, concurrency: int=None, timeout: float=None, max_num_results: int=None) -> list:
+    """
+    Print each source's results as soon as it finishes instead of waiting for the slowest one,
+    then summarize the sources that failed, timed out or found nothing
+    """
+    results = {}
+    for i, df in iterate_sources(sources, query=query, title=title, author=author, limits=limits, concurrency=concurrency, timeout=timeout):
+        results[i] = df
+        if not df.empty and get_status(df) is None:
+            print_source_results(sources[i] | {'df': df}, max_num_results)
+
+    unfinished = [f"{x['source']}: {get_status(results[i]) or 'no results'}"
+                  for i, x in enumerate(sources) if results[i].empty or get_status(results[i])]
+    if unfinished:
+        print('\nNOT SHOWN\n' + '\n'.join(unfinished) + '\n')
+    return [x | {'df': results[i]} for i, x in enumerate(sources)]
+
+
+def search_offline(query: str, selected_sources: list) -> list:
+    """
+    Answer a search from the result store, formatting each source's stored rows as if just
+    fetched (prices are converted with the stored exchange rates, which are not refreshed)
+    """
+    import pandas as pd
+    from tools.store import get_store
+    from tools.currency import rates_offline
+
+    sources_results = []
+    for source in selected_sources:
+        df_stored = get_store().search(query, sources=[source])
+        formatter = FORMATTERS.get(source, format_results_default)
+        with rates_offline():
+            results_tables = [formatter(df.drop(columns=['source', 'search_url', 'fetched_at']).dropna(axis='columns', how='all').reset_index(drop=True), url)
+                              for url, df in df_stored.groupby('search_url', sort=False)] if not df_stored.empty else []
+        sources_results.append({
+            "source": source,
+            "urls": [f"stored results matching '{query}'"],
+            "df": pd.concat(results_tables) if results_tables else pd.DataFrame(),
+        })
+    return sources_results
+
+
+def run_sources(sources: list, query: str=None, title: str=None, author: str=None, limits: dict=None, concurrency: int=None, timeout: float=None) -> list:
+    """ fetch and parse all sources at the same time, returning them in their original order """
+    results = dict(iterate_sources(sources, query=query, title=title, author=author, limits=limits, concurrency=concurrency, timeout=timeout))
+    return [x | {'df': results[i]} for i, x in enumerate(sources)]
+
+
+def iterate_sources(sources: list, query: str=None, title: str=None, author: str=None, limits: dict=None, concurrency: int=None, timeout: float=None):
+    """
+    Fetch and parse all sources at the same time, yielding (index, results) of each as soon as
+    it finishes. A source still running `timeout` seconds after it started is yielded with a
+    single 'timed out' status row rather than holding up the others.
+    """
+    started = {}
+
+    def run_source(i, source):
+        started[i] = time.monotonic()
+        return search_source(source['source'], source['urls'], query=query, title=title, author=author, limits=limits, timeout=timeout)
+
+    slots = threading.Semaphore(concurrency) if concurrency else None
+    futures = {submit_daemon(run_source, i, x, slots=slots): i for i, x in enumerate(sources)}
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures[future]
+                try:
+                    yield i, future.result()
+                except FetchError as e:
+                    yield i, status_table(f'error: {e}')
+                except Exception as e:
+                    yield i, status_table(f'failed: {e!r}')
+            now = time.monotonic()
+            for future in list(pending):
+                i = futures[future]
+                if timeout and i in started and now - started[i] > timeout:
+                    # hand its slot to a queued source rather than wait for the stuck request
+                    future.release_slot()
+                    future.cancel()
+                    pending.discard(future)
+                    yield i, status_table(f'timed out after {timeout:g}s')
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def submit_daemon(function, *args, slots: threading.Semaphore=None, **kwargs) -> Future:
+    """
+    Run `function` on a new daemon thread (once one of `slots` is free, if given) and return its
+    future. Unlike executor workers, daemon threads are not joined when the interpreter exits,
+    so a source stuck on a request after timing out can't keep the command from finishing.
+    The slot is given back when the function returns, or earlier by `future.release_slot()`.
+    """
+    future = Future()
+    held_slots = []
+    held_slots_lock = threading.Lock()
+
+    def release_slot():
+        with held_slots_lock:
+            if held_slots:
+                held_slots.pop().release()
+
+    def run():
+        if slots:
+            slots.acquire()
+            with held_slots_lock:
+                held_slots.append(slots)
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(function(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+        finally:
+            release_slot()
+
+    future.release_slot = release_slot
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def search_source(source: str, search_urls: list, query: str=None, title: str=None, author: str=None, limits: dict=None, timeout: float=None) -> pd.DataFrame:
+    """
+    Fetch, parse and format every search url of a source at the same time and stack the results.
+    `title` and `author` let sources drop results that don't match the search and `limits`
+    (max_results, max_price) let sources that page through results stop early.
+    A url that fails adds a status row unless every url failed, which raises the first error.
+    """
+    import pandas as pd
+
+    formatter = FORMATTERS.get(source, format_results_default)
+
+    def search_url(url):
+        with metrics.record(source, url, query=query):
+            df_results = sources.fetch_results(source, url, query=query, title=title, author=author, timeout=timeout, **(limits or {}))
+            with metrics.timed('format'):
+                return formatter(df_results, url)
+
+    futures = [submit_daemon(search_url, x) for x in search_urls]
+    wait(futures)
+    errors = [x.exception() for x in futures if x.exception()]
+    if errors and len(errors) == len(futures):
+        raise errors[0]
+
+    results_tables = [x.result() for x in futures if not x.exception()]
+    results_tables_notempty = [x for x in results_tables if not x.empty]
+    error_tables = [status_table(f'error: {e}') for e in errors]
+    if not results_tables_notempty and not error_tables:
+        return pd.DataFrame()
+    if not results_tables_notempty:
+        return pd.concat(error_tables, ignore_index=True)
+
+    df_all_results = pd.concat(results_tables_notempty)
+    if error_tables:
+        df_all_results = pd.concat([df_all_results, *error_tables]).fillna('')
+    return df_all_results
+
+
+def status_table(status: str) -> pd.DataFrame:
+    import pandas as pd
+    return pd.DataFrame({'Status': [status]})
+
+
+def get_status(df: pd.DataFrame) -> str:
+    """ the status of a source that produced a status table instead of results, otherwise None """
+    return df['Status'].iloc[0] if list(df.columns) == ['Status'] else None
 
 
 def stringify_table(df: pd.DataFrame) -> str:
+    import tabulate
     return tabulate.tabulate(df, showindex=False, headers=df.columns)
 
 
-def format_results_goodreads(search_url: str) -> None:
-    content = requests.get(search_url).content
-    df_results = goodreads.parse_results(content)
+def format_results_default(df_results: pd.DataFrame, search_url: str=None) -> pd.DataFrame:
+    return df_results
+
+
+def format_results_goodreads(df_results: pd.DataFrame, search_url: str=None) -> pd.DataFrame:
     df_formatted = (df_results
         .drop(columns='link')
         .assign(
@@ -95,10 +605,7 @@ def format_results_goodreads(search_url: str) -> None:
     return df_formatted
 
 
-def format_results_annas_archive(search_url: str) -> pd.DataFrame:
-    content = requests.get(search_url).content
-    df_results = annas.parse_results(content)
-
+def format_results_annas_archive(df_results: pd.DataFrame, search_url: str=None) -> pd.DataFrame:
     if df_results.empty:
         return df_results
 
@@ -125,70 +632,73 @@ def format_results_annas_archive(search_url: str) -> pd.DataFrame:
 
 
 
-def format_results_bibliocommons(search_urls: list) -> None:
-    results_tables = []
-    for search_url in search_urls:
-        content = requests.get(search_url).content
-        df_results = biblio.parse_results(content)
-
-        if df_results.empty:
-            return df_results
-
-        df_formatted = (
-            df_results
-            .assign(
-                title = lambda t: t['title'].str[:30],
-                author = lambda t: t['author'].str[:15], 
-            )
-            .assign(library = biblio.extract_library_subdomain(search_url))
-            [['library', 'title', 'author', 'true_format', 'hold_counts']]
-            .rename(columns={
-                'library': 'Library',
-                'title': 'Title',
-                'author': 'Author',
-                'true_format': 'Format',
-                'hold_counts': 'Holds',
-                'eresource_link': 'e-Resource',
-            })
-        )
+def format_results_bibliocommons(df_results: pd.DataFrame, search_url: str) -> pd.DataFrame:
+    from tools.bibliocommons import extract_library_subdomain
 
-        results_tables.append(df_formatted)
-    
-    df_all_results = pd.concat(results_tables)
-    return df_all_results
+    if df_results.empty:
+        return df_results
+
+    df_formatted = (
+        df_results
+        .assign(
+            title = lambda t: t['title'].str[:30],
+            author = lambda t: t['author'].str[:15], 
+        )
+        .assign(library = extract_library_subdomain(search_url))
+        [['library', 'title', 'author', 'true_format', 'hold_counts']]
+        .rename(columns={
+            'library': 'Library',
+            'title': 'Title',
+            'author': 'Author',
+            'true_format': 'Format',
+            'hold_counts': 'Holds',
+            'eresource_link': 'e-Resource',
+        })
+    )
+    return df_formatted
 
 
 
-def format_results_abebooks(search_url: str) -> None:
-    content = requests.get(search_url).content
-    df_results = abe.parse_results(content)
+def format_results_abebooks(df_results: pd.DataFrame, search_url: str=None) -> pd.DataFrame:
+    import numpy as np
+    from tools.currency import get_rate_provider
 
     if df_results.empty:
         return df_results
 
+    try:
+        to_cad_factors = get_rate_provider('CAD').get_conversion_factors()
+    except RuntimeError as e:
+        print(f'abebooks: prices are not converted: {e}', file=sys.stderr)
+        to_cad_factors = {}
+    df_results = note_missing_rates(df_results, to_cad_factors)
+    num_unconverted = df_results.issues.str.contains('no CAD rate').sum()
+    if num_unconverted:
+        print(f'abebooks: {num_unconverted} listings are in a currency with no CAD rate, their prices show as ?', file=sys.stderr)
+
     df_formatted = (
         df_results
         .convert_dtypes()
         .fillna({
-            'price_usd': 0,
-            'shipping_cost_usd': 0
+            'price': 0,
+            'shipping_cost': 0
         })
         .assign(
-            price_cad = lambda t: t.price_usd.multiply(USD_TO_CAD_FACTOR),
-            shipping_cost_cad = lambda t: t.shipping_cost_usd.multiply(USD_TO_CAD_FACTOR),
+            price_cad = lambda t: t.price.multiply(t.currency.map(to_cad_factors).astype('float')),
+            shipping_cost_cad = lambda t: t.shipping_cost.multiply(t.shipping_currency.map(to_cad_factors).astype('float')),
         )
         .assign(
             in_edmonton = lambda t: t.seller.str.lower().str.contains('edmonton'),
             # they always list them in USD but the in-store price is the same value in CAD
-            price_cad = lambda t: np.where(t.seller.str.lower().str.contains('edmonton book store'), t.price_usd, t.price_cad),
+            price_cad = lambda t: np.where(t.seller.str.lower().str.contains('edmonton book store'), t.price, t.price_cad),
             shipping_cost_cad = lambda t: np.where(t.in_edmonton, 0.0, t.shipping_cost_cad),
         )
         .assign(
             total_price_cad = lambda t: t.price_cad + t.shipping_cost_cad,
             price_description = lambda t: (
-                t.price_cad.astype('int').astype('string')
-                + ' + ' + t.shipping_cost_cad.astype('int').astype('string')
-                + ' = ' + t.total_price_cad.astype('int').astype('string')
+                format_whole_number(t.price_cad)
+                + ' + ' + format_whole_number(t.shipping_cost_cad)
+                + ' = ' + format_whole_number(t.total_price_cad)
                 ),
         )
         .assign(
@@ -215,6 +725,40 @@ def format_results_abebooks(search_url: str) -> None:
     return df_formatted
 
 
+def note_missing_rates(df_results: pd.DataFrame, to_cad_factors: dict) -> pd.DataFrame:
+    """ add an issue to listings priced or shipped in a currency with no CAD rate (their CAD prices are left empty) """
+    import pandas as pd
+
+    currencies = df_results[['currency', 'shipping_currency']]
+    missing = currencies.where(currencies.notna() & ~currencies.isin(list(to_cad_factors)))
+    notes = missing.apply(lambda x: '; '.join(f'no CAD rate for {c}' for c in dict.fromkeys(x.dropna())), axis='columns')
+    issues = df_results['issues'].fillna('') if 'issues' in df_results.columns else pd.Series('', index=df_results.index)
+    return df_results.assign(issues=(issues + '; ' + notes).str.strip('; '))
+
+
+def format_whole_number(values: pd.Series) -> pd.Series:
+    """ numbers without their fractions as strings, '?' where missing """
+    import numpy as np
+    return np.trunc(values.astype('float')).astype('Int64').astype('string').fillna('?')
+
+
+FORMATTERS = {
+    'goodreads': format_results_goodreads,
+    'abebooks': format_results_abebooks,
+    'library': format_results_bibliocommons,
+    'annas': format_results_annas_archive,
+}
+
+
+COMMANDS = {
+    'batch': batch_main,
+    'toread': toread_main,
+    'watch': watch_main,
+    'serve': serve_main,
+    'works': works_main,
+    'reparse': reparse_main,
+}
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,48 @@
+from pathlib import Path
+from datetime import timedelta
+from types import SimpleNamespace
+import tools.archive as archive
+from tools.store import configure_store
+from tools.webscraping import get_response_content
+
+FIXTURES_DIR = Path(__file__).parents[1] / 'benchmarks' / 'fixtures'
+SEARCH_URL = 'https://www.abebooks.com/servlet/SearchResults?tn=dune'
+
+
+def test_reparse_stacks_only_the_latest_run(tmp_path, monkeypatch):
+    content = (FIXTURES_DIR / 'abebooks.html').read_bytes()
+    response_archive = archive.configure_archive(directory=tmp_path / 'archive')
+    configure_store(path=tmp_path / 'results.sqlite')
+    monkeypatch.setattr('tools.webscraping.get_cache', lambda: None)
+
+    response = SimpleNamespace(status_code=200, headers={}, content=content, elapsed=timedelta(0))
+    monkeypatch.setattr('tools.webscraping.get_client', lambda: SimpleNamespace(get=lambda url, **kwargs: response))
+    # an earlier run paged 5 at a time, the latest fetched one page of 30
+    with archive.archiving('abebooks', SEARCH_URL, query='dune', parser_version=1):
+        get_response_content(SEARCH_URL + '&ds=5&bsi=0')
+        get_response_content(SEARCH_URL + '&ds=5&bsi=5')
+    with archive.archiving('abebooks', SEARCH_URL, query='dune', parser_version=1):
+        get_response_content(SEARCH_URL + '&ds=30&bsi=0')
+
+    try:
+        df_summary = archive.reparse(response_archive, sources=['abebooks'], force=True).set_index('source')
+    finally:
+        archive.configure_archive(enabled=False)
+        configure_store(enabled=False)
+    assert df_summary.loc['abebooks', 'searches'] == 1
+    assert df_summary.loc['abebooks', 'pages'] == 1
+    assert df_summary.loc['abebooks', 'rows'] == 100
+
+
+def test_unchanged_response_is_not_stored_again(tmp_path):
+    response_archive = archive.ResponseArchive(directory=tmp_path / 'archive')
+    page = {'source': 'abebooks', 'search_url': SEARCH_URL, 'url': SEARCH_URL, 'status': 200, 'headers': {}}
+    first = response_archive.append(content=b'<html>dune</html>', **page)
+    again = response_archive.append(content=b'<html>dune</html>', **page)
+    changed = response_archive.append(content=b'<html>dune messiah</html>', **page)
+
+    segment = response_archive.get_segment_path(1)
+    assert [x[2] for x in archive.iterate_segment(segment)] == [b'<html>dune</html>', b'<html>dune messiah</html>']
+    assert response_archive.read(again)[1] == response_archive.read(first)[1] == b'<html>dune</html>'
+    assert response_archive.read(changed)[1] == b'<html>dune messiah</html>'
+    assert [x['id'] for x in response_archive.get_latest_runs()] == [changed]
@@ -0,0 +1,32 @@
+import time
+import threading
+import pandas as pd
+import pytest
+import tools.batch as batch
+
+
+def test_interrupted_batch_leaves_the_rest_unrun(tmp_path, monkeypatch):
+    searched = []
+    lock = threading.Lock()
+
+    def search_query_source(title, author, source, timeout=None):
+        with lock:
+            searched.append(title)
+        time.sleep(0.1)
+        return pd.DataFrame({'title': [title]})
+
+    mark_done = batch.Checkpoint.mark_done
+    def mark_done_then_interrupt(self, key, **details):
+        # as if ctrl-c was pressed once the first search was written
+        mark_done(self, key, **details)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(batch, 'search_query_source', search_query_source)
+    monkeypatch.setattr(batch.Checkpoint, 'mark_done', mark_done_then_interrupt)
+    queries = pd.DataFrame({'title': [f'book {i}' for i in range(40)], 'author': ''})
+
+    with pytest.raises(KeyboardInterrupt):
+        batch.run_batch(queries, ['kobo'], tmp_path / 'results.jsonl', tmp_path / 'checkpoint.jsonl', concurrency=2)
+
+    assert len(searched) <= 4
+    assert len(batch.Checkpoint(tmp_path / 'checkpoint.jsonl').done) == 1
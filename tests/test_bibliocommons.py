@@ -0,0 +1,15 @@
+import argparse
+import pytest
+import booksearch
+from tools.bibliocommons import register_library, list_libraries
+
+
+@pytest.mark.parametrize('subdomain', ['epl.example.com/x', 'EPL', 'e p l'])
+def test_bad_subdomains_are_rejected(subdomain):
+    with pytest.raises(ValueError):
+        register_library(subdomain)
+    with pytest.raises(argparse.ArgumentTypeError):
+        booksearch.library_subdomain(subdomain)
+    with pytest.raises(ValueError):
+        booksearch.compose_request_urls('library', {'title': 'dune', 'libraries': [subdomain]})
+    assert subdomain not in list_libraries()
@@ -0,0 +1,52 @@
+import os
+from types import SimpleNamespace
+import pytest
+import tools.cache as cache
+from tools.cache import ResponseCache, MINUTE, DAY
+
+LIBRARY_URL = 'https://epl.bibliocommons.com/v2/search?query=dune'
+GOODREADS_URL = 'https://www.goodreads.com/search?q=dune'
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(cache, 'time', SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_entries_expire_after_their_hosts_ttl(tmp_path, clock):
+    response_cache = ResponseCache(tmp_path)
+    response_cache.set(LIBRARY_URL, b'holds')
+    response_cache.set(GOODREADS_URL, b'ratings')
+
+    clock.now += 20 * MINUTE
+    assert response_cache.get(LIBRARY_URL) is None # 15 minutes for hold counts
+    assert response_cache.get(GOODREADS_URL) == b'ratings'
+    clock.now += 7 * DAY
+    assert response_cache.get(GOODREADS_URL) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    # random bytes don't compress, so each entry takes a little over 1000 bytes
+    response_cache = ResponseCache(tmp_path, max_size_bytes=2500)
+    urls = [f'{GOODREADS_URL}&page={i}' for i in range(3)]
+    response_cache.set(urls[0], os.urandom(1000))
+    clock.now += 1
+    response_cache.set(urls[1], os.urandom(1000))
+    clock.now += 1
+    assert response_cache.get(urls[0]) is not None
+    clock.now += 1
+    response_cache.set(urls[2], os.urandom(1000))
+
+    assert [response_cache.get(x) is not None for x in urls] == [True, False, True]
+
+
+def test_refresh_skips_reads_but_stores(tmp_path, clock):
+    ResponseCache(tmp_path).set(GOODREADS_URL, b'old', etag='"1"')
+    refreshing_cache = ResponseCache(tmp_path, refresh=True)
+    assert refreshing_cache.get(GOODREADS_URL) is None
+    assert refreshing_cache.get_validators(GOODREADS_URL) is None
+
+    refreshing_cache.set(GOODREADS_URL, b'new')
+    assert ResponseCache(tmp_path).get(GOODREADS_URL) == b'new'
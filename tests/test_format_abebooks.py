@@ -0,0 +1,40 @@
+import pytest
+from pathlib import Path
+import booksearch
+import tools.abebooks as abebooks
+from tools.currency import configure_rate_provider, rates_offline
+
+FIXTURES_DIR = Path(__file__).parents[1] / 'benchmarks' / 'fixtures'
+
+
+def test_currency_without_rate_is_flagged_not_fatal():
+    configure_rate_provider('CAD', path=FIXTURES_DIR / 'rates.json', ttl=float('inf'))
+    df_results = abebooks.parse_results((FIXTURES_DIR / 'abebooks.html').read_bytes())
+    df_results.loc[df_results.index[0], 'currency'] = 'XYZ'
+
+    assert 'no CAD rate for XYZ' in booksearch.note_missing_rates(df_results, {'CAD': 1.0, 'USD': 1.4}).issues.iloc[0]
+    df_formatted = booksearch.format_results_abebooks(df_results)
+    assert len(df_formatted) == len(df_results)
+    assert df_formatted.loc[df_results.index[0], 'Price (CAD)'].startswith('? + ')
+
+
+def test_offline_rates_are_never_refreshed(tmp_path, monkeypatch):
+    rates_path = tmp_path / 'rates.json'
+    rates_path.write_text((FIXTURES_DIR / 'rates.json').read_text())
+    provider = configure_rate_provider('CAD', path=rates_path, ttl=0)
+    monkeypatch.setattr(provider, '_refresh', lambda: pytest.fail('offline rates were refreshed'))
+    df_results = abebooks.parse_results((FIXTURES_DIR / 'abebooks.html').read_bytes())
+
+    with rates_offline():
+        assert not booksearch.format_results_abebooks(df_results)['Price (CAD)'].str.startswith('?').any()
+
+
+def test_offline_without_stored_rates_shows_unknown_prices(tmp_path):
+    configure_rate_provider('CAD', path=tmp_path / 'rates.json')
+    df_results = abebooks.parse_results((FIXTURES_DIR / 'abebooks.html').read_bytes())
+
+    with rates_offline():
+        df_formatted = booksearch.format_results_abebooks(df_results)
+    # edmonton sellers need no rate, their usd prices are taken as cad and they don't ship
+    converted = ~df_results.seller.str.lower().str.contains('edmonton').reindex(df_formatted.index)
+    assert df_formatted.loc[converted, 'Price (CAD)'].str.startswith('? + ').all()
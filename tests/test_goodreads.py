@@ -0,0 +1,18 @@
+from pathlib import Path
+import tools.sources as sources
+from tools.store import configure_store
+
+FIXTURES_DIR = Path(__file__).parents[1] / 'benchmarks' / 'fixtures'
+
+
+def test_fetch_results_drops_off_title_rows(monkeypatch):
+    content = (FIXTURES_DIR / 'goodreads.html').read_bytes()
+    monkeypatch.setattr('tools.webscraping.get_response_content', lambda search_url, timeout=None: content)
+    configure_store(enabled=False)
+
+    search_url = sources.compose_search_urls('goodreads', title='Dune Messiah', author='Frank Herbert')[0]
+    df_unfiltered = sources.fetch_results('goodreads', search_url)
+    df_results = sources.fetch_results('goodreads', search_url, title='Dune Messiah', author='Frank Herbert')
+
+    assert 'The Green Brain (Dune, #2)' in df_unfiltered.title.tolist()
+    assert df_results[['title', 'author']].values.tolist() == [['Dune Messiah (Dune, #3)', 'Frank Herbert']]
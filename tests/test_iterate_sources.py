@@ -0,0 +1,52 @@
+import sys
+import time
+import threading
+import subprocess
+from pathlib import Path
+import pandas as pd
+import booksearch
+
+REPO_DIR = Path(__file__).parents[1]
+
+# one source hangs far past the timeout, the other answers at once
+HANGING_SEARCH = """
+import time
+import pandas as pd
+import booksearch
+
+def fetch_results(source, url, **kwargs):
+    if source == 'annas':
+        time.sleep(30)
+    return pd.DataFrame({'title': ['Dune']})
+
+booksearch.sources.fetch_results = fetch_results
+results = booksearch.run_sources([{'source': 'annas', 'urls': ['a']}, {'source': 'other', 'urls': ['b']}], timeout=0.5)
+print(booksearch.get_status(results[0]['df']), len(results[1]['df']))
+"""
+
+
+def test_timed_out_source_does_not_hold_up_exit():
+    start = time.monotonic()
+    result = subprocess.run([sys.executable, '-c', HANGING_SEARCH], cwd=REPO_DIR, capture_output=True, text=True, timeout=20)
+    assert result.stdout.strip() == 'timed out after 0.5s 1'
+    assert time.monotonic() - start < 10
+
+
+def test_timed_out_source_gives_up_its_slot(monkeypatch):
+    hung = threading.Event()
+
+    def fetch_results(source, url, **kwargs):
+        if source == 'annas':
+            hung.wait(5)
+        return pd.DataFrame({'title': ['Dune']})
+
+    monkeypatch.setattr(booksearch.sources, 'fetch_results', fetch_results)
+    start = time.monotonic()
+    try:
+        finished = {}
+        for i, df in booksearch.iterate_sources([{'source': 'annas', 'urls': ['a']}, {'source': 'other', 'urls': ['b']}], concurrency=1, timeout=0.5):
+            finished[i] = time.monotonic() - start
+    finally:
+        hung.set()
+    # the queued source starts once the hung one times out, not once its request returns
+    assert finished[1] < 2
@@ -0,0 +1,35 @@
+import importlib
+from pathlib import Path
+import pandas as pd
+import pytest
+from tools.webscraping import available_parser_backends, set_parser_backend
+
+FIXTURES_DIR = Path(__file__).parents[1] / 'benchmarks' / 'fixtures'
+
+# parser module and the recorded page it is checked against
+PARSERS = {
+    'goodreads': ('tools.goodreads', 'goodreads.html'),
+    'abebooks': ('tools.abebooks', 'abebooks.html'),
+    'bibliocommons': ('tools.bibliocommons', 'bibliocommons.html'),
+    'annas_archive': ('tools.annas_archive', 'annas_archive.html'),
+    'indigo': ('tools.indigo', 'indigo.html'),
+    'kobo': ('tools.kobo', 'kobo.html'),
+}
+
+REFERENCE_BACKEND = 'html.parser'
+
+
+def parse_with_backend(module: str, content: bytes, backend: str) -> pd.DataFrame:
+    set_parser_backend(backend)
+    try:
+        return importlib.import_module(module).parse_results(content)
+    finally:
+        set_parser_backend(None)
+
+
+@pytest.mark.parametrize('backend', [x for x in available_parser_backends() if x != REFERENCE_BACKEND])
+@pytest.mark.parametrize('source', PARSERS)
+def test_backends_parse_the_same(source, backend):
+    module, fixture = PARSERS[source]
+    content = (FIXTURES_DIR / fixture).read_bytes()
+    pd.testing.assert_frame_equal(parse_with_backend(module, content, backend), parse_with_backend(module, content, REFERENCE_BACKEND))
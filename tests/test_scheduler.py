@@ -0,0 +1,111 @@
+import time
+from types import SimpleNamespace
+from email.utils import formatdate
+import pandas as pd
+import pytest
+import booksearch
+import tools.scheduler as scheduler
+from tools.scheduler import FetchError, RequestScheduler, TokenBucket
+
+URL = 'https://www.abebooks.com/servlet/SearchResults?tn=dune'
+
+
+class FakeClock:
+    """ stands in for the time module so waits are recorded rather than slept """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler, 'time', clock)
+    return clock
+
+
+def make_send_request(*responses):
+    """ a send_request returning these (status, headers) in turn, counting the calls """
+    calls = []
+
+    def send_request():
+        status, headers = responses[len(calls)]
+        calls.append(status)
+        return SimpleNamespace(status_code=status, reason='', headers=headers)
+    return send_request, calls
+
+
+def test_retryable_statuses_are_retried(clock):
+    send_request, calls = make_send_request((429, {'Retry-After': '7'}), (503, {}), (200, {}))
+    response = RequestScheduler(backoff_base=1.0).send(URL, send_request)
+
+    assert response.status_code == 200
+    assert calls == [429, 503, 200]
+    # the 429 waits as long as it asked to, the 503 backs off by up to 2s (attempt 1)
+    assert clock.sleeps[0] == 7
+    assert 0 <= sum(clock.sleeps[1:]) <= 2
+
+
+def test_client_errors_are_not_retried(clock):
+    send_request, calls = make_send_request((404, {}), (200, {}))
+    with pytest.raises(FetchError) as e:
+        RequestScheduler().send(URL, send_request)
+
+    assert e.value.status == 404
+    assert calls == [404]
+
+
+def test_retries_give_up_with_the_last_error(clock):
+    send_request, calls = make_send_request(*[(503, {})] * 3)
+    with pytest.raises(FetchError) as e:
+        RequestScheduler(max_retries=2).send(URL, send_request)
+
+    assert e.value.status == 503
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize('retry_after, seconds', [('12', 12), ('-3', 0), ('600', 60), ('soon', None), (None, None)])
+def test_retry_after_seconds(clock, retry_after, seconds):
+    response = SimpleNamespace(headers={'Retry-After': retry_after} if retry_after else {})
+    assert RequestScheduler(backoff_max=60).get_retry_after(response) == seconds
+
+
+def test_retry_after_http_date(clock):
+    response = SimpleNamespace(headers={'Retry-After': formatdate(clock.now + 30, usegmt=True)})
+    assert RequestScheduler().get_retry_after(response) == pytest.approx(30, abs=1)
+
+
+def test_token_bucket_allows_bursts_then_the_rate(clock):
+    bucket = TokenBucket(rate=2.0, capacity=3)
+    for _ in range(5):
+        bucket.acquire()
+
+    # three at once, then one every half second
+    assert sum(clock.sleeps) == pytest.approx(1.0)
+    bucket.pause(10)
+    bucket.acquire()
+    assert clock.now == pytest.approx(1000.0 + 1.0 + 10)
+
+
+def test_failed_source_is_an_error_not_an_empty_result(monkeypatch):
+    def fetch_results(source, url, **kwargs):
+        if source == 'kobo':
+            raise FetchError(url, 404, 'Not Found')
+        return pd.DataFrame()
+
+    monkeypatch.setattr(booksearch.sources, 'fetch_results', fetch_results)
+    results = dict(booksearch.iterate_sources([{'source': 'kobo', 'urls': [URL]}, {'source': 'indigo', 'urls': [URL]}]))
+
+    assert booksearch.get_status(results[0]) == f'error: 404 Not Found from {URL}'
+    assert results[1].empty and booksearch.get_status(results[1]) is None
@@ -0,0 +1,29 @@
+import pytest
+import pandas as pd
+import booksearch
+from tools.scheduler import FetchError
+
+EPL_URL = 'https://epl.bibliocommons.com/v2/search?query=dune'
+CALGARY_URL = 'https://calgary.bibliocommons.com/v2/search?query=dune'
+
+
+def test_one_library_errors_others_empty(monkeypatch):
+    def fetch_results(source, url, **kwargs):
+        if url == EPL_URL:
+            raise FetchError(url, 503, 'Service Unavailable')
+        return pd.DataFrame()
+
+    monkeypatch.setattr(booksearch.sources, 'fetch_results', fetch_results)
+    df = booksearch.search_source('library', [EPL_URL, CALGARY_URL])
+
+    assert list(df.columns) == ['Status']
+    assert booksearch.get_status(df).startswith('error: 503')
+
+
+def test_every_url_errors_raises(monkeypatch):
+    def fetch_results(source, url, **kwargs):
+        raise FetchError(url, 503)
+
+    monkeypatch.setattr(booksearch.sources, 'fetch_results', fetch_results)
+    with pytest.raises(FetchError):
+        booksearch.search_source('library', [EPL_URL, CALGARY_URL])
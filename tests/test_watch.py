@@ -0,0 +1,16 @@
+import pandas as pd
+import booksearch
+import tools.watch as watch
+
+
+def test_round_without_hold_counts_is_reported(monkeypatch, capsys, tmp_path):
+    df_changes = pd.DataFrame({
+        'library': ['epl'], 'title': ['Dune'], 'author': ['Frank Herbert'], 'format': ['BK'], 'change': ['new'],
+        'availability_status': ['AVAILABLE'], 'holds': [None], 'copies': [None], 'wait_days': [None],
+    })
+    monkeypatch.setattr(watch, 'watch', lambda *args, **kwargs: iter([df_changes, None, df_changes]))
+    booksearch.watch_main(['watchlist.csv', '--once', '--state', str(tmp_path / 'watch.sqlite')])
+
+    out, err = capsys.readouterr()
+    assert out.count('1 changes') == 2
+    assert 'could not report' in err
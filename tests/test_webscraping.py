@@ -0,0 +1,29 @@
+import pytest
+import pandas as pd
+import booksearch
+from tools.webscraping import PARSER_BACKENDS, set_parser_backend, get_parser_backend, refilter_mask
+
+
+def test_parser_choices_match_the_backends():
+    assert booksearch.PARSER_BACKENDS == list(PARSER_BACKENDS)
+
+
+def test_unknown_parser_backend_is_rejected():
+    backend = get_parser_backend()
+    with pytest.raises(ValueError):
+        set_parser_backend('html5lib')
+    assert get_parser_backend() == backend
+
+
+CANDIDATES = pd.Series(['Dune Messiah', 'Children of Dune', 'The Dune Encyclopedia', 'Messiah: Dune Book 2', None])
+
+
+@pytest.mark.parametrize('mode, search_string, matches', [
+    ('all', 'messiah dune', [True, False, False, True, False]),
+    ('strict', 'dune messiah', [True, False, False, False, False]),
+    ('strict', 'messiah dune', [False, False, False, True, False]), # punctuation is ignored
+    ('fuzzy', 'dune messiah book', [True, False, False, True, False]),
+    ('all', '', [True] * 5),
+])
+def test_refilter_modes(mode, search_string, matches):
+    assert refilter_mask(CANDIDATES, search_string, mode=mode, fuzzy_threshold=0.6).tolist() == matches
@@ -1,16 +1,19 @@
-from bs4 import BeautifulSoup
-from typing import Literal
-import requests
+from typing import Literal, Iterator
 from urllib.parse import quote, quote_plus
 import re
 import pandas as pd
+from tools.webscraping import make_soup, get_response_content
 import numpy as np
 from functools import partial
+from itertools import count, chain
+from bs4 import SoupStrainer
 
 # TODO: add a 'strict' filter mode where the title inputs are quoted
 
 # TODO: decide if this conversion is really necessary
 
+PARSER_VERSION = 1
+
 ALHAMBRA_BOOKS_SELLER_ID = 3054340
 EDMONTON_BOOK_STORE_SELLER_ID = 19326
 THE_BOOKSELLER_SELLER_ID = 51101471
@@ -23,6 +26,18 @@ SELLERS = {
 
 ON_OFF_TYPE = Literal['on', 'off']
 
+# symbols abebooks puts in front of displayed prices
+CURRENCY_SYMBOLS = {
+    'US$': 'USD',
+    'C$': 'CAD',
+    'CA$': 'CAD',
+    'AU$': 'AUD',
+    'A$': 'AUD',
+    'NZ$': 'NZD',
+    '£': 'GBP',
+    '€': 'EUR',
+}
+
 
 def compose_search_url(
     title: str=None,
@@ -43,6 +58,7 @@ def compose_search_url(
     year_high: int=None,
     sortby: str='total-price',
     num_results: int=100,
+    start_index: int=None,
     first_edition: ON_OFF_TYPE=None,
     dust_jacket: ON_OFF_TYPE=None,
     rollup: ON_OFF_TYPE=None,
@@ -89,6 +105,7 @@ def compose_search_url(
         "sts": "t", 
         "bx": boolean_search,
         "ds": num_results,
+        "bsi": start_index,
         "n": condition_mappings.get(condition),
         "fe": first_edition,
         "recentlyadded": recentlyadded,
@@ -119,50 +136,102 @@ def compose_search_url(
     return search_url
 
 
-def parse_results(content: bytes) -> pd.DataFrame:
+TOTAL_PRICE_SORTBY_CODE = '17' # the 'sortby' argument when sorting by 'total-price'
+DEFAULT_PAGE_SIZE = 30
+MAX_PAGES = 50
+
+
+def set_page(search_url: str, page_size: int, start_index: int) -> str:
+    """ point a search url at one page of results """
+    return re.sub(r'&(ds|bsi)=[^&]*', '', search_url) + f'&ds={page_size}&bsi={start_index}'
+
+
+def iterate_result_pages(
+    search_url: str,
+    page_size: int=DEFAULT_PAGE_SIZE,
+    max_results: int=None,
+    max_total_price: float=None,
+    price_factors: dict=None,
+    timeout: float=None,
+) -> Iterator[pd.DataFrame]:
     """
-    Parse the response content returned by an Abebooks search request
+    Yield the parsed results of a search a page at a time, only fetching each page once the
+    previous one has been consumed. Stops after `max_results` listings or, when sorted by
+    total price, at the first listing whose price plus shipping is over `max_total_price`
+    (in the listings' own currency, or converted with `price_factors` as from RateProvider).
     """
+    sorted_by_total_price = re.search(r'[?&]sortby=(\d+)', search_url)
+    sorted_by_total_price = bool(sorted_by_total_price) and sorted_by_total_price.group(1) == TOTAL_PRICE_SORTBY_CODE
+    page_size = min(page_size, max_results) if max_results else page_size
+    num_yielded = 0
+
+    for start_index in count(0, page_size):
+        df_page = parse_results(get_response_content(set_page(search_url, page_size, start_index), timeout=timeout))
+        if df_page.empty:
+            return
+        num_page_listings = len(df_page)
+
+        reached_ceiling = False
+        if max_total_price is not None:
+            total_price = (
+                df_page.price.fillna(0) * get_factors(df_page.currency, price_factors)
+                + df_page.shipping_cost.fillna(0) * get_factors(df_page.shipping_currency, price_factors)
+            )
+            over_ceiling = total_price.gt(max_total_price).to_numpy()
+            reached_ceiling = sorted_by_total_price and over_ceiling.any()
+            df_page = df_page.iloc[:over_ceiling.argmax()] if reached_ceiling else df_page.loc[~over_ceiling]
 
-    soup = BeautifulSoup(content, features='html.parser')
-    results_block = soup.find('ul', class_='result-block', id='srp-results')
+        if max_results:
+            df_page = df_page.head(max_results - num_yielded)
+        num_yielded += len(df_page)
+        if not df_page.empty:
+            yield df_page
 
-    if not results_block:
-        return pd.DataFrame()
+        finished_pages = num_page_listings < page_size or start_index // page_size + 1 >= MAX_PAGES
+        if reached_ceiling or (max_results and num_yielded >= max_results) or finished_pages:
+            return
 
-    result_items = []
-    for x in results_block.find_all('li', attrs={'data-cy': 'listing-item'}):
-
-        # get all metadata
-        metadata = {y.get('itemprop'): y.get('content') for y in x.find_all('meta')}
-        currency = metadata['priceCurrency']
-        assert currency == 'USD', f'this thing is only set up to handle USD as the source currency, (What is {currency}?)'
-
-        # get other pieces of data
-        shipping_details = x.find('a', class_='item-shipping-dest').getText().strip()
-        assert shipping_details.strip().lower().endswith('canada')
-
-        shipping_cost_raw = x.find('span', class_='item-shipping').getText()
-        shipping_cost_raw = 'US$ 0' if 'free' in shipping_cost_raw.lower() else shipping_cost_raw
-        assert 'US$' in shipping_cost_raw, f'this thing is only set up to handle USD as the source currency (dont understand {shipping_cost_raw})'
-        shipping_cost_usd = (
-            shipping_cost_raw
-            .strip()
-            .strip('US$ ')
-            .strip(' Shipping')
-        )
 
-        seller_raw = x.find('div', class_='bookseller-info').getText()
-        seller = re.sub(r'^\s+Seller:\s+(.*?)\n.*', r'\1', seller_raw, flags=re.DOTALL)
+def get_factors(currencies: pd.Series, price_factors: dict=None) -> pd.Series:
+    return currencies.map(price_factors).astype('float') if price_factors else 1.0
+
 
-        other_data = {
-            "seller": seller,
-            "shipping_details": shipping_details,
-            "shipping_cost_usd": shipping_cost_usd
-        }
+def fetch_listings(search_url: str, max_results: int=None, max_price: float=None, currency: str='CAD', timeout: float=None) -> pd.DataFrame:
+    """ get every listing of a search up to `max_results` or a total price of `max_price` in `currency` """
+    price_factors = None
+    if max_price is not None:
+        from tools.currency import get_rate_provider
+        price_factors = get_rate_provider(currency).get_conversion_factors()
+
+    pages = list(iterate_result_pages(search_url, max_results=max_results, max_total_price=max_price, price_factors=price_factors, timeout=timeout))
+    return pd.concat(pages, ignore_index=True) if pages else pd.DataFrame()
+
+
+# (tag, class) of the listing elements read besides the itemprop <meta> tags
+LISTING_FIELDS = {
+    ('a', 'item-shipping-dest'): 'shipping_details',
+    ('span', 'item-shipping'): 'shipping_cost_raw',
+    ('div', 'bookseller-info'): 'seller_raw',
+}
 
-        all_data = metadata | other_data
-        result_items.append(all_data)
+
+def parse_results(content: bytes) -> pd.DataFrame:
+    """
+    Parse the response content returned by an Abebooks search request.
+    Only the elements listings are read from are built into a tree (see ListingStrainer), and
+    anything unexpected about a listing is reported in its 'issues' column instead of failing
+    the whole page.
+    """
+    strainer = ListingStrainer()
+    # cut down to the results block first, so nothing after the last listing is counted as part of it
+    soup = make_soup(slice_results_block(content), parse_only=strainer)
+    listings = [[] for _ in range(strainer.num_listings)]
+    for listing_number, element in zip(strainer.listing_numbers, soup.find_all(recursive=False)):
+        listings[listing_number].append(element)
+    result_items = [extract_listing(x) for x in listings]
+
+    if not result_items:
+        return pd.DataFrame()
 
     df_results = (pd
         .DataFrame(result_items)
@@ -170,20 +239,130 @@ def parse_results(content: bytes) -> pd.DataFrame:
         .rename(columns={
             "name": "title",
             "datePublished": "date_published",
-            "price": "price_usd",
             "priceCurrency": "currency",
             "itemCondition": "condition",
             "bookEdition": "edition",
             "bookFormat": "binding",
         })
-        .assign(condition = lambda t: t.about.apply(get_condition_description))
+        .assign(condition = lambda t: t.about.apply(get_condition_description) if 'about' in t.columns else '')
         .convert_dtypes()
-        .astype({'price_usd': 'float', 'shipping_cost_usd': 'float'})
+        .assign(
+            price = lambda t: pd.to_numeric(t.get('price', ''), errors='coerce').astype('float'),
+            shipping_cost = lambda t: pd.to_numeric(t.shipping_cost, errors='coerce').astype('float'),
+        )
         # TODO: add another way to get "edition" here (in case it's non-existant) by parsing 'about'
     )
 
     return df_results
 
+
+class ListingStrainer(SoupStrainer):
+    """
+    Builds only the itemprop <meta> tags and the LISTING_FIELDS elements of each listing rather
+    than every element of the page. The listing <li> tags aren't built either, so the listing
+    each element belongs to is counted here as the page is parsed (the parser asks about the
+    elements in document order).
+    """
+
+    def __init__(self):
+        super().__init__(['meta', *{name for name, _ in LISTING_FIELDS}])
+        self.num_listings = 0
+        self.listing_numbers = [] # of each element built, in order
+
+    def allow_tag_creation(self, nsprefix: str, name: str, attrs: dict) -> bool:
+        attrs = attrs or {}
+        if name == 'li' and attrs.get('data-cy') == 'listing-item':
+            self.num_listings += 1
+            return False
+        classes = attrs.get('class') or ''
+        classes = classes.split() if isinstance(classes, str) else classes
+        is_field = (name == 'meta' and bool(attrs.get('itemprop'))) or any((name, x) in LISTING_FIELDS for x in classes)
+        if not is_field or not self.num_listings:
+            return False
+        self.listing_numbers.append(self.num_listings - 1)
+        return True
+
+    # the same check under its name before beautifulsoup 4.13
+    def search_tag(self, name: str=None, attrs: dict=None) -> bool:
+        return self.allow_tag_creation(None, name, attrs)
+
+
+RESULTS_BLOCK_START_PATTERN = re.compile(rb'<ul\b[^>]*\bid=["\']srp-results["\']')
+UL_TAG_PATTERN = re.compile(rb'<(/?)ul\b', flags=re.IGNORECASE)
+
+
+def slice_results_block(content: bytes) -> bytes:
+    """ cut the raw page down to the results <ul> so the parser never sees the rest of the page """
+    start_match = RESULTS_BLOCK_START_PATTERN.search(content)
+    if not start_match:
+        return b''
+    depth = 0
+    for tag in UL_TAG_PATTERN.finditer(content, start_match.start()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            return content[start_match.start():content.index(b'>', tag.end()) + 1]
+    return content[start_match.start():]
+
+
+def extract_listing(elements: list) -> dict:
+    """ read the metadata, shipping and seller of one listing in a single walk over the elements built of it """
+    metadata = {}
+    fields = {}
+    for node in chain.from_iterable((x, *x.descendants) for x in elements):
+        if node.name is None:
+            continue
+        if node.name == 'meta':
+            if itemprop := node.get('itemprop'):
+                metadata.setdefault(itemprop, node.get('content'))
+            continue
+        for class_ in node.get('class', ()):
+            field = LISTING_FIELDS.get((node.name, class_))
+            if field and field not in fields:
+                fields[field] = node.getText()
+
+    issues = []
+    currency = metadata.get('priceCurrency') or ''
+    if not currency:
+        issues.append('no price currency')
+
+    shipping_details = fields.get('shipping_details', '').strip()
+    if not shipping_details:
+        issues.append('no shipping destination')
+    elif not shipping_details.lower().endswith('canada'):
+        issues.append(f'ships to {shipping_details!r}')
+
+    shipping_cost, shipping_currency = None, currency
+    if 'shipping_cost_raw' not in fields:
+        issues.append('no shipping cost')
+    else:
+        try:
+            shipping_cost, shipping_currency = parse_displayed_price(fields['shipping_cost_raw'], default_currency=currency)
+        except ValueError as e:
+            issues.append(str(e))
+
+    seller = re.sub(r'^\s+Seller:\s+(.*?)\n.*', r'\1', fields.get('seller_raw', ''), flags=re.DOTALL)
+
+    return metadata | {
+        "seller": seller,
+        "shipping_details": shipping_details,
+        "shipping_cost": shipping_cost,
+        "shipping_currency": shipping_currency,
+        "issues": '; '.join(issues),
+    }
+
+
+def parse_displayed_price(price_text: str, default_currency: str) -> tuple:
+    """ split a displayed price like 'US$ 4.50 Shipping' into its amount and currency code """
+    if 'free' in price_text.lower():
+        return 0.0, default_currency
+    price_match = re.search(r'([^\d\s]*)\s*(\d[\d,]*(?:\.\d+)?)', price_text)
+    if not price_match:
+        raise ValueError(f"don't understand the price {price_text.strip()!r}")
+    symbol, amount = price_match.groups()
+    currency = CURRENCY_SYMBOLS.get(symbol, symbol.upper() or default_currency)
+    return float(amount.replace(',', '')), currency
+
+
 def get_condition_description(about: str) -> str:
     search_result = re.search(r'Condition:\s+(.*?)(\.|$)', about)
     condition = search_result.group(1).lower().strip() if search_result else ''
@@ -1,9 +1,10 @@
 import re
 import pandas as pd
 from urllib.parse import quote_plus
-from bs4 import BeautifulSoup
 from typing import Literal
-from tools.webscraping import get_text
+from tools.webscraping import get_text, make_soup
+
+PARSER_VERSION = 1
 
 
 CONTENT_TYPES = Literal[
@@ -77,37 +78,32 @@ def compose_search_url(
     return search_url
 
 
-def parse_results(content: bytes) -> pd.DataFrame:
+# results are lazy-rendered inside html comments in these blocks; anything after the
+# "partial match" heading only matches some of the search words
+RESULT_BLOCK_PATTERN = re.compile(rb'<div class="h-\[125\][^"]*"[^>]*>')
+PARTIAL_MATCH_PATTERN = re.compile(rb'<div class="[^"]*\bitalic\b[^"]*"[^>]*>[^<]*partial match')
+DIV_TAG_PATTERN = re.compile(rb'<(/?)div\b')
 
-    results_uncommented_html = (
-        content
-        .decode('utf-8')
-        .replace('<!--', '')
-        .replace('-->', '')
-    )
-
-    soup = BeautifulSoup(results_uncommented_html, features='html.parser')
-
-    # remove all the "partial matches" from the soup
-    if 'partial match' in soup.getText():
-        try:
-            partmatch = [x for x in soup.find_all('div', class_='italic') if 'partial match' in x.getText()][0]
-            for div in partmatch.findNextSiblings():
-                div.decompose()
-        except:
-            # TODO: this is bad, we should probably do another check instead with the result items first
-            # TODO: make this dependent on the output columns somehow (also for all the other toolsw
-            return pd.DataFrame()
+# e.g. 'English [en], epub, 0.6MB, "Dune - Frank Herbert.epub"'
+FILE_DETAILS_PATTERN = re.compile(r'^(?:.*?\[(?P<language>.*?)\])?(?:.*?(?P<filetype>\w+), (?=<?[\d.]+MB))?.*?(?P<filesize><?[\d.]+)MB(?:.*?"(?P<filename>.+)")?')
 
-    result_items = [x.find('a').find('div').findNextSibling() 
-                    for x in soup.find_all('div', class_='h-[125]')]
 
-    if not result_items:
-        # TODO: remove this repeated thing
+def parse_results(content: bytes) -> pd.DataFrame:
+    """
+    Parse the response content returned by an Anna's Archive search request.
+    Only the result blocks before the partial matches are uncommented and parsed.
+    """
+    result_blocks = extract_result_blocks(content)
+
+    if not result_blocks:
+        # TODO: make this dependent on the output columns somehow (also for all the other toolsw
         return pd.DataFrame()
 
+    soup = make_soup(b''.join(result_blocks).decode('utf-8'))
+    result_items = [x.find('a').find('div').findNextSibling() 
+                    for x in soup.find_all('div', class_='h-[125]')]
+
     # TODO: add in link 
-    # TODO: add in file extension
     result_items_data = []
     for x in result_items:
         file_details = x.find('div', class_='text-xs')
@@ -115,29 +111,6 @@ def parse_results(content: bytes) -> pd.DataFrame:
         author = x.find('div', class_='italic')
         title = x.find('h3')
 
-        file_details_text = get_text(file_details)
-
-        try:
-            filesize_mb = float(re.search(r'(\S+)MB', file_details_text).group(1).replace('<', ''))
-        except:
-            filesize_mb = 0
-
-        try:
-            item_language = re.search(r'^.*?\[(.*?)\].*MB', file_details_text).group(1)
-        except:
-            item_language = ''
-
-        try:
-            item_filetype = re.search(r'(\w+), \S+MB', file_details_text).group(1)
-        except:
-            item_filetype = ''
-
-        try:
-            filename = re.search(r'"(.+)"', file_details_text).group(1)
-        except:
-            filename = ''
-
-
         # TODO: add a second filter on the returned data based on the input arguments just
         # to make it extra sure
 
@@ -145,12 +118,42 @@ def parse_results(content: bytes) -> pd.DataFrame:
             "title": get_text(title).strip(),
             "author": get_text(author).strip(),
             "publisher": get_text(publisher).strip(),
-            "filesize_mb": filesize_mb,
-            "language": item_language,
-            "filetype": item_filetype,
-            "filename": filename,
-        })
+        } | parse_file_details(get_text(file_details)))
 
     data = pd.DataFrame(result_items_data)
 
     return data
+
+
+def extract_result_blocks(content: bytes) -> list:
+    """ cut out each (uncommented) result block that comes before the partial matches """
+    partial_match = PARTIAL_MATCH_PATTERN.search(content)
+    end = partial_match.start() if partial_match else len(content)
+
+    result_blocks = []
+    for block_start in RESULT_BLOCK_PATTERN.finditer(content, 0, end):
+        depth = 0
+        for tag in DIV_TAG_PATTERN.finditer(content, block_start.start(), end):
+            depth += -1 if tag.group(1) else 1
+            if depth == 0:
+                block = content[block_start.start():content.index(b'>', tag.end()) + 1]
+                result_blocks.append(block.replace(b'<!--', b'').replace(b'-->', b''))
+                break
+    return result_blocks
+
+
+def parse_file_details(file_details_text: str) -> dict:
+    details_match = FILE_DETAILS_PATTERN.search(file_details_text)
+    details = details_match.groupdict(default='') if details_match else {}
+
+    try:
+        filesize_mb = float(details['filesize'].replace('<', ''))
+    except (KeyError, ValueError):
+        filesize_mb = 0
+
+    return {
+        "filesize_mb": filesize_mb,
+        "language": details.get('language', ''),
+        "filetype": details.get('filetype', ''),
+        "filename": details.get('filename', ''),
+    }
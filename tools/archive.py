@@ -0,0 +1,244 @@
+"""
+An append-only archive of the raw responses fetched for each search url, so results can be
+parsed again with the current parsers after a site changes its markup, without fetching
+anything. Each response is appended zlib-compressed to a segment file along with its url,
+source, query, time, status and headers, and a SQLite index points at every record's
+segment and position and notes the version of the parser that last read it. The responses
+fetched for one search url in one go share a run id, so its pages are parsed together. A
+response identical to the last one archived for its url (e.g. answered from the response
+cache) is indexed again but points at the stored copy.
+"""
+import sys
+import json
+import time
+import zlib
+import hashlib
+import struct
+import uuid
+import sqlite3
+import threading
+import contextvars
+from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from tools.cache import DATA_DIR
+
+ARCHIVE_DIR = DATA_DIR / 'archive'
+MAX_SEGMENT_BYTES = 1024 * 1024 * 1024 # a new segment file is started once one passes this size
+DEFAULT_CONCURRENCY = 8
+
+# each record is its compressed length followed by zlib(json metadata + b'\n' + content),
+# so a segment can be read back without the index
+RECORD_LENGTH = struct.Struct('>I')
+
+_current_search = contextvars.ContextVar('archive_search', default=None)
+
+
+def read_record(path: Path, position: int) -> tuple:
+    """ the metadata and content of the record at `position` of a segment """
+    with open(path, 'rb') as f:
+        f.seek(position)
+        length, = RECORD_LENGTH.unpack(f.read(RECORD_LENGTH.size))
+        metadata, content = zlib.decompress(f.read(length)).split(b'\n', 1)
+    return json.loads(metadata), content
+
+
+def iterate_segment(path: Path):
+    """ yield the position, metadata and content of every record of a segment in the order they were appended """
+    with open(path, 'rb') as f:
+        while header := f.read(RECORD_LENGTH.size):
+            length, = RECORD_LENGTH.unpack(header)
+            metadata, content = zlib.decompress(f.read(length)).split(b'\n', 1)
+            yield f.tell() - length - RECORD_LENGTH.size, json.loads(metadata), content
+
+
+class ResponseArchive:
+    """ raw responses appended to numbered segment files in `directory` and indexed in SQLite """
+
+    def __init__(self, directory: Path=ARCHIVE_DIR, max_segment_bytes: int=MAX_SEGMENT_BYTES):
+        self.directory = Path(directory)
+        self.max_segment_bytes = max_segment_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.directory / 'index.sqlite', check_same_thread=False)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS records (
+                id INTEGER PRIMARY KEY,
+                source TEXT NOT NULL,
+                query TEXT NOT NULL,
+                search_url TEXT NOT NULL,
+                run_id TEXT NOT NULL,
+                url TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                segment INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                parser_version INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS records_search_url ON records (source, search_url);
+            CREATE INDEX IF NOT EXISTS records_url ON records (url);
+        """)
+        self._segment = max((int(x.stem.split('-')[-1]) for x in self.directory.glob('responses-*.bin')), default=1)
+
+    def get_segment_path(self, segment: int) -> Path:
+        return self.directory / f'responses-{segment:05}.bin'
+
+    def append(self, source: str, search_url: str, url: str, status: int, headers: dict, content: bytes, query: str='', title: str=None, author: str=None, parser_version: int=None, run_id: str=None) -> int:
+        """ add a response to the end of the current segment and return its record id (with no `run_id` it is a run of its own) """
+        metadata = {
+            "source": source,
+            "query": query,
+            "title": title,
+            "author": author,
+            "search_url": search_url,
+            "run_id": run_id or uuid.uuid4().hex,
+            "url": url,
+            "fetched_at": time.time(),
+            "status": status,
+            "headers": {k: v for k, v in headers.items() if k.lower() != 'set-cookie'},
+        }
+        content_hash = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            latest = self._connection.execute('SELECT segment, position, length, content_hash FROM records WHERE url = ? ORDER BY id DESC LIMIT 1', (url,)).fetchone()
+        stored = latest[:3] if latest and latest[3] == content_hash else None
+        record = None if stored else zlib.compress(json.dumps(metadata).encode('utf-8') + b'\n' + content)
+        with self._lock:
+            if record:
+                path = self.get_segment_path(self._segment)
+                if path.exists() and path.stat().st_size + len(record) > self.max_segment_bytes:
+                    self._segment += 1
+                    path = self.get_segment_path(self._segment)
+                with open(path, 'ab') as f:
+                    position = f.tell()
+                    f.write(RECORD_LENGTH.pack(len(record)) + record)
+                stored = (self._segment, position, len(record))
+            cursor = self._connection.execute(
+                'INSERT INTO records (source, query, search_url, run_id, url, fetched_at, status, headers, segment, position, length, content_hash, parser_version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (source, query, search_url, metadata['run_id'], url, metadata['fetched_at'], status, json.dumps(metadata['headers']), *stored, content_hash, parser_version),
+            )
+            self._connection.commit()
+        return cursor.lastrowid
+
+    def read(self, record_id: int) -> tuple:
+        """ the metadata and content of an archived response """
+        with self._lock:
+            row = self._connection.execute('SELECT segment, position FROM records WHERE id = ?', (record_id,)).fetchone()
+        if not row:
+            raise KeyError(f'no archived response {record_id}')
+        return read_record(self.get_segment_path(row[0]), row[1])
+
+    def get_latest_runs(self, sources: list=None) -> list:
+        """
+        The successful (or revalidated) responses of the newest run of every search url (of
+        `sources` if given), in the order they were fetched. Pages of earlier runs, which may
+        have used other page sizes, are left out so no listing is counted twice.
+        """
+        source_filter = f"AND source IN ({','.join('?' * len(sources))})" if sources else ''
+        with self._lock:
+            rows = self._connection.execute(
+                f"""
+                SELECT id, source, query, search_url, url, fetched_at, parser_version FROM records
+                WHERE status IN (200, 304) AND run_id IN (
+                    SELECT run_id FROM records WHERE id IN (
+                        SELECT MAX(id) FROM records WHERE status IN (200, 304) {source_filter} GROUP BY source, search_url
+                    )
+                )
+                ORDER BY id
+                """,
+                sources or [],
+            ).fetchall()
+        columns = ['id', 'source', 'query', 'search_url', 'url', 'fetched_at', 'parser_version']
+        return [dict(zip(columns, x)) for x in rows]
+
+    def mark_parsed(self, record_ids: list, parser_version: int) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany('UPDATE records SET parser_version = ? WHERE id = ?', [(parser_version, x) for x in record_ids])
+
+
+@contextmanager
+def archiving(source: str, search_url: str, query: str=None, title: str=None, author: str=None, parser_version: int=None):
+    """ archive the responses fetched in the block as one run of a search url of `source` """
+    search = {'source': source, 'search_url': search_url, 'query': query or '', 'title': title, 'author': author}
+    token = _current_search.set(search | {'parser_version': parser_version, 'run_id': uuid.uuid4().hex})
+    try:
+        yield
+    finally:
+        _current_search.reset(token)
+
+
+def archive_response(url: str, content: bytes, status: int=200, headers: dict=None) -> None:
+    """
+    Append a response to the shared archive, if responses are being archived and it was
+    fetched for a search url. Content answered from the response cache is archived too (with
+    no headers), so a search is archived whether or not it went to the network, though
+    unchanged content is only indexed and not stored again.
+    """
+    archive = get_archive()
+    search = _current_search.get()
+    if archive is not None and search is not None:
+        archive.append(url=url, status=status, headers=headers or {}, content=content, **search)
+
+
+def reparse(archive: ResponseArchive, sources: list=None, force: bool=False, concurrency: int=DEFAULT_CONCURRENCY):
+    """
+    Parse the newest archived run of every search url again with the current parsers and
+    replace its rows in the result store, skipping search urls already read by the current
+    PARSER_VERSION of their source (unless `force`). The pages of a run (e.g. abebooks result
+    pages) are stacked, without the limits the search was run with.
+    Returns the number of search urls, pages and rows reparsed per source.
+    """
+    import pandas as pd
+    from tools.sources import list_sources, get_parser_version, parse_content_in_pool
+    from tools.store import get_store
+
+    versions = {x: get_parser_version(x) for x in (sources or list_sources())}
+    searches = {}
+    for record in archive.get_latest_runs(list(versions)):
+        searches.setdefault((record['source'], record['search_url']), []).append(record)
+    due = {k: v for k, v in searches.items() if force or any(x['parser_version'] != versions[k[0]] for x in v)}
+    store = get_store()
+
+    def reparse_search(source: str, search_url: str, records: list) -> int:
+        pages = [parse_content_in_pool(source, content, title=metadata.get('title'), author=metadata.get('author'))
+                 for metadata, content in (archive.read(x['id']) for x in records)]
+        pages_notempty = [x for x in pages if not x.empty]
+        df_results = pages[0] if len(pages) == 1 else pd.concat(pages_notempty, ignore_index=True) if pages_notempty else pd.DataFrame()
+        if store:
+            store.save(source, records[-1]['query'], search_url, df_results)
+        archive.mark_parsed([x['id'] for x in records], versions[source])
+        return len(df_results)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {k: executor.submit(reparse_search, *k, v) for k, v in due.items()}
+
+    summary = {x: {'source': x, 'searches': 0, 'pages': 0, 'rows': 0, 'failed': 0} for x in versions}
+    for (source, search_url), future in futures.items():
+        if future.exception():
+            summary[source]['failed'] += 1
+            print(f'{source}: could not parse {search_url}: {future.exception()!r}', file=sys.stderr)
+            continue
+        summary[source]['searches'] += 1
+        summary[source]['pages'] += len(due[source, search_url])
+        summary[source]['rows'] += future.result()
+    return pd.DataFrame(list(summary.values()))
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive() -> ResponseArchive:
+    """ get the shared archive, or None if responses are not being archived """
+    with _archive_lock:
+        return _archive
+
+
+def configure_archive(enabled: bool=True, **kwargs) -> ResponseArchive:
+    """ start (or stop) archiving responses to a shared archive built from `kwargs` (see ResponseArchive) """
+    global _archive
+    with _archive_lock:
+        _archive = ResponseArchive(**kwargs) if enabled else None
+        return _archive
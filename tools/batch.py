@@ -0,0 +1,130 @@
+"""
+Search every selected source for a whole list of books. Each finished (query, source) pair
+is checkpointed and its rows are appended to the output straight away, so an interrupted
+run picks up where it stopped when started again with the same checkpoint file.
+"""
+import sys
+import json
+import time
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+import tools.sources as sources
+import tools.metrics as metrics
+from tools.scheduler import FetchError
+
+DEFAULT_CONCURRENCY = 4
+
+# columns that mark a csv as a goodreads library export
+GOODREADS_EXPORT_COLUMNS = {'Book Id', 'Title', 'Author', 'Bookshelves', 'Exclusive Shelf'}
+
+
+def read_queries(input_path: Path, shelves: list=None) -> pd.DataFrame:
+    """
+    Read the books to search for from either a csv with 'title' and 'author' columns or a
+    Goodreads library export (optionally only the books on `shelves`).
+    """
+    input_columns = set(pd.read_csv(input_path, nrows=0).columns)
+
+    if GOODREADS_EXPORT_COLUMNS.issubset(input_columns):
+        from tools.goodreads import read_library_export
+        df_input = read_library_export(input_path, shelves=shelves)
+    else:
+        df_input = pd.read_csv(input_path, dtype='string')
+
+    return (df_input
+        [['title', 'author']]
+        .fillna('')
+        .drop_duplicates()
+        .reset_index(drop=True)
+    )
+
+
+def make_key(title: str, author: str, source: str) -> str:
+    return json.dumps([title, author, source])
+
+
+class Checkpoint:
+    """ an append-only jsonl record of the (query, source) pairs that are finished """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.done = set()
+        if self.path.exists():
+            with open(self.path) as f:
+                self.done = {json.loads(line)['key'] for line in f if line.strip()}
+        self._lock = threading.Lock()
+
+    def is_done(self, key: str) -> bool:
+        return key in self.done
+
+    def mark_done(self, key: str, **details) -> None:
+        with self._lock, open(self.path, 'a') as f:
+            f.write(json.dumps({'key': key, 'finished_at': time.time()} | details) + '\n')
+            self.done.add(key)
+
+
+def search_query_source(title: str, author: str, source: str, timeout: float=None) -> pd.DataFrame:
+    results_tables = []
+    for search_url in sources.compose_search_urls(source, title=title, author=author):
+        with metrics.record(source, search_url, query_title=title, query_author=author):
+            df_results = sources.fetch_results(source, search_url, query=sources.join_query(title, author), title=title, author=author, timeout=timeout)
+        results_tables.append(df_results.assign(search_url=search_url))
+
+    return (pd
+        .concat(results_tables)
+        .assign(query_title=title, query_author=author, source=source)
+    )
+
+
+def run_batch(
+    queries: pd.DataFrame,
+    selected_sources: list,
+    output_path: Path,
+    checkpoint_path: Path,
+    concurrency: int=DEFAULT_CONCURRENCY,
+    timeout: float=None,
+) -> None:
+    """
+    Search every source for every query, skipping pairs already in the checkpoint, and
+    append each pair's rows to `output_path` (json lines) as soon as it finishes.
+    """
+    checkpoint = Checkpoint(checkpoint_path)
+    pending = [(x.title, x.author, source)
+               for x in queries.itertuples()
+               for source in selected_sources
+               if not checkpoint.is_done(make_key(x.title, x.author, source))]
+    num_skipped = len(queries) * len(selected_sources) - len(pending)
+    print(f'{len(pending)} searches to run ({num_skipped} already done)', file=sys.stderr)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor, open(output_path, 'a') as output:
+        futures = {executor.submit(search_query_source, *x, timeout=timeout): x for x in pending}
+        try:
+            write_finished(futures, len(pending), output, checkpoint)
+        except KeyboardInterrupt:
+            # leaving the block waits for every queued search, so drop those that haven't started
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+def write_finished(futures: dict, num_pending: int, output, checkpoint: Checkpoint) -> None:
+    """ append the rows of each search to `output` and checkpoint it as it finishes """
+    for i, future in enumerate(as_completed(futures), start=1):
+        title, author, source = futures[future]
+        try:
+            df_results = future.result()
+        except FetchError as e:
+            # not checkpointed, so the next run tries it again
+            print(f'[{i}/{num_pending}] {source}: {title} ({author}) error: {e}', file=sys.stderr)
+            continue
+        except Exception as e:
+            # not checkpointed, so the next run tries it again
+            print(f'[{i}/{num_pending}] {source}: {title} ({author}) failed: {e!r}', file=sys.stderr)
+            continue
+
+        if not df_results.empty:
+            output.write(df_results.to_json(orient='records', lines=True).rstrip('\n') + '\n')
+            output.flush()
+        checkpoint.mark_done(make_key(title, author, source), rows=len(df_results))
+        print(f'[{i}/{num_pending}] {source}: {title} ({author}) {len(df_results)} rows', file=sys.stderr)
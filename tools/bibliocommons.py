@@ -1,12 +1,12 @@
 from functools import partial
+import os
 import re
+import sys
 import numpy as np
-from bs4 import BeautifulSoup
-import requests
 from urllib.parse import quote_plus
 import pandas as pd
 from typing import Callable, Literal
-from tools.webscraping import refilter, get_text
+from tools.webscraping import refilter_mask, REFILTER_MODES, get_text, make_soup, explode_records
 
 valid_formatcodes = Literal[
     'BK',
@@ -14,16 +14,43 @@ valid_formatcodes = Literal[
     'AB'
 ]
 
-valid_library_subdomains = Literal[
-    'epl',
-    'calgary'
-]
-
-# TODO: calculate waiting period for books
+# waiting periods are estimated from hold count history in tools.watch
 # TODO: make this exhaustive
 # VALID_FORMATCODES = ['BK', 'AB', 'EBOOK']
 
-def generate_compose_search_url_function(library_subdomain: valid_library_subdomains) -> Callable:
+PARSER_VERSION = 1
+
+# every library that can be searched, by bibliocommons subdomain (https://<subdomain>.bibliocommons.com)
+LIBRARIES = {}
+SUBDOMAIN_PATTERN = re.compile(r'[a-z0-9-]+')
+_selected_libraries = None
+
+
+def register_library(subdomain: str, name: str='') -> None:
+    if not SUBDOMAIN_PATTERN.fullmatch(subdomain):
+        raise ValueError(f'{subdomain} is not a bibliocommons subdomain')
+    LIBRARIES[subdomain] = {"subdomain": subdomain, "name": name or subdomain}
+
+
+def list_libraries() -> list:
+    return list(LIBRARIES)
+
+
+def get_libraries() -> list:
+    """ the libraries searched by default: the selected ones, otherwise every registered one """
+    return _selected_libraries or list_libraries()
+
+
+def set_libraries(subdomains: list=None) -> None:
+    """ search only these libraries (registering any unknown subdomains), or every registered one if None """
+    global _selected_libraries
+    for subdomain in subdomains or []:
+        if subdomain not in LIBRARIES:
+            register_library(subdomain)
+    _selected_libraries = list(subdomains) if subdomains else None
+
+
+def generate_compose_search_url_function(library_subdomain: str) -> Callable:
     # TODO: add in exhaustive set of allowable inputs
     def compose_search_url(
         title: str=None,
@@ -44,8 +71,8 @@ def generate_compose_search_url_function(library_subdomain: valid_library_subdom
 
     return compose_search_url
 
-def parse_results(results_html: bytes, title_refilter: str = None, author_refilter: str = None) -> pd.DataFrame:
-    soup = BeautifulSoup(results_html, features='html.parser')
+def parse_results(results_html: bytes, title_refilter: str = None, author_refilter: str = None, refilter_mode: REFILTER_MODES = 'all') -> pd.DataFrame:
+    soup = make_soup(results_html)
 
     try:
         result_items = soup.find('ul', class_='results').find_all('li', class_='cp-search-result-item')
@@ -84,7 +111,7 @@ def parse_results(results_html: bytes, title_refilter: str = None, author_refilt
 
 
     base_data = pd.DataFrame(result_items_data)
-    formats = base_data.formats.explode().apply(pd.Series)
+    formats = explode_records(base_data.formats)
     data = base_data.drop(columns='formats').join(formats)
 
     data = (data
@@ -93,10 +120,10 @@ def parse_results(results_html: bytes, title_refilter: str = None, author_refilt
     )
 
     if title_refilter:
-        data = data.loc[lambda t: (t['title'] + ' ' + t['subtitle']).apply(lambda x: refilter(x, title_refilter))]
+        data = data.loc[lambda t: refilter_mask(t['title'] + ' ' + t['subtitle'], title_refilter, mode=refilter_mode)]
 
     if author_refilter:
-        data = data.loc[lambda t: t['author'].apply(lambda x: refilter(x, author_refilter))]
+        data = data.loc[lambda t: refilter_mask(t['author'], author_refilter, mode=refilter_mode)]
 
     return data
 
@@ -115,7 +142,20 @@ def get_available_formats(parsed_data: pd.DataFrame) -> str:
 
 
 def extract_library_subdomain(search_url: str) -> str:
-    return re.search(r'https://(\w+)', search_url).group(1)
+    return re.search(r'https://([\w-]+)', search_url).group(1)
+
+
+def compose_search_urls(title: str=None, author: str=None, libraries: list=None) -> list:
+    """ one search url per library (default: get_libraries()) """
+    return [generate_compose_search_url_function(x)(title=title, author=author) for x in (libraries or get_libraries())]
+
+
+register_library('epl', 'Edmonton Public Library')
+register_library('calgary', 'Calgary Public Library')
+
+# extra libraries: comma-separated subdomains, each optionally followed by =<name>
+for library in filter(None, os.environ.get('BOOKSEARCH_LIBRARIES', '').split(',')):
+    register_library(*(x.strip() for x in library.split('=', 1)))
 
 
 
@@ -0,0 +1,163 @@
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+CACHE_DIR = Path(os.environ.get('BOOKSEARCH_CACHE_DIR', Path.home() / '.cache' / 'booksearch'))
+# state that should outlive the cache (e.g. to-read check history)
+DATA_DIR = Path(os.environ.get('BOOKSEARCH_DATA_DIR', Path.home() / '.local' / 'share' / 'booksearch'))
+DEFAULT_MAX_SIZE_BYTES = 200 * 1024 * 1024
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# matched against the end of the request host, so 'bibliocommons.com' covers every library
+SOURCE_TTL_SECONDS = {
+    'bibliocommons.com': 15 * MINUTE, # hold counts and availability change quickly
+    'abebooks.com': 6 * HOUR,
+    'chapters.indigo.ca': 6 * HOUR,
+    'kobo.com': DAY,
+    'goodreads.com': 7 * DAY,
+    'annas-archive.org': 7 * DAY,
+    'googleapis.com': 7 * DAY,
+}
+DEFAULT_TTL_SECONDS = HOUR
+
+
+def canonicalize_url(url: str) -> str:
+    """ normalize a url so equivalent requests share a cache entry (case of host, query order, fragment) """
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', query, ''))
+
+
+def get_ttl(url: str) -> float:
+    host = urlsplit(url).netloc.lower()
+    return next((ttl for suffix, ttl in SOURCE_TTL_SECONDS.items() if host == suffix or host.endswith('.' + suffix)), DEFAULT_TTL_SECONDS)
+
+
+class ResponseCache:
+    """
+    Raw response content stored zlib-compressed in a single SQLite file. Entries expire
+    after the ttl of their source and the least recently used ones are evicted once the
+    total stored size passes `max_size_bytes`. Expired entries keep their ETag and
+    Last-Modified so they can be revalidated instead of downloaded again.
+    """
+
+    def __init__(self, directory: Path=CACHE_DIR, max_size_bytes: int=DEFAULT_MAX_SIZE_BYTES, refresh: bool=False):
+        self.max_size_bytes = max_size_bytes
+        self.refresh = refresh
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(Path(directory) / 'responses.sqlite', check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL,
+                content BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT
+            )
+        """)
+        self._connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(url: str) -> str:
+        return hashlib.sha256(canonicalize_url(url).encode('utf-8')).hexdigest()
+
+    def get(self, url: str) -> bytes:
+        """ return the cached content for `url`, or None if it is missing, expired or being refreshed """
+        if self.refresh:
+            return None
+        key = self.make_key(url)
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute('SELECT stored_at, content FROM responses WHERE key = ?', (key,)).fetchone()
+            if not row or now - row[0] > get_ttl(url):
+                return None
+            self._connection.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            self._connection.commit()
+        return zlib.decompress(row[1])
+
+    def get_validators(self, url: str) -> dict:
+        """
+        Get the content of an expired entry with its ETag and Last-Modified, so the server can
+        be asked whether it changed, or None if there is no entry with a validator.
+        """
+        if self.refresh:
+            return None
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT content, etag, last_modified FROM responses WHERE key = ? AND (etag IS NOT NULL OR last_modified IS NOT NULL)',
+                (self.make_key(url),),
+            ).fetchone()
+        if not row:
+            return None
+        return {"content": zlib.decompress(row[0]), "etag": row[1], "last_modified": row[2]}
+
+    def revalidate(self, url: str) -> None:
+        """ mark an entry the server said is unchanged (304) as fresh again """
+        now = time.time()
+        with self._lock:
+            self._connection.execute('UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?', (now, now, self.make_key(url)))
+            self._connection.commit()
+
+    def set(self, url: str, content: bytes, etag: str=None, last_modified: str=None) -> None:
+        compressed = zlib.compress(content)
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO responses (key, url, stored_at, accessed_at, size, content, etag, last_modified) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.make_key(url), canonicalize_url(url), now, now, len(compressed), compressed, etag, last_modified),
+            )
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self) -> None:
+        total_size, = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()
+        if total_size <= self.max_size_bytes:
+            return
+        evicted = []
+        for key, size in self._connection.execute('SELECT key, size FROM responses ORDER BY accessed_at'):
+            if total_size <= self.max_size_bytes:
+                break
+            evicted.append((key,))
+            total_size -= size
+        self._connection.executemany('DELETE FROM responses WHERE key = ?', evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute('DELETE FROM responses')
+            self._connection.commit()
+
+
+_cache = None
+_cache_enabled = True
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ResponseCache:
+    """ get the shared cache (created in CACHE_DIR on first use), or None if caching is disabled """
+    global _cache
+    with _cache_lock:
+        if _cache_enabled and _cache is None:
+            _cache = ResponseCache()
+        return _cache if _cache_enabled else None
+
+
+def configure_cache(enabled: bool=True, **kwargs) -> ResponseCache:
+    """ turn the shared cache on or off, or rebuild it from `kwargs` (see ResponseCache) """
+    global _cache, _cache_enabled
+    with _cache_lock:
+        _cache_enabled = enabled
+        _cache = ResponseCache(**kwargs) if enabled else None
+        return _cache
@@ -0,0 +1,95 @@
+import json
+import time
+import threading
+import warnings
+import contextvars
+from pathlib import Path
+from contextlib import contextmanager
+from tools.cache import CACHE_DIR, HOUR
+
+RATES_PATH = CACHE_DIR / 'rates.json'
+RATES_TTL_SECONDS = 12 * HOUR
+BASE_CURRENCY = 'CAD'
+
+_offline = contextvars.ContextVar('rates_offline', default=False)
+
+
+class RateProvider:
+    """
+    Exchange rates against `base`, fetched from forex_python only when first needed and
+    kept on disk for `ttl` seconds. When a refresh fails the last stored table is used.
+    Inside `rates_offline()` nothing is fetched and the stored table is used however old it is.
+    """
+
+    def __init__(self, base: str=BASE_CURRENCY, path: Path=RATES_PATH, ttl: float=RATES_TTL_SECONDS):
+        self.base = base
+        self.path = Path(path)
+        self.ttl = ttl
+        self._table = None
+        self._lock = threading.Lock()
+
+    def get_rates(self) -> dict:
+        """ get the number of units of each currency that one unit of the base currency buys """
+        with self._lock:
+            if self._table is None and self.path.exists():
+                self._table = json.loads(self.path.read_text())
+            if self._table is None or self._table['base'] != self.base:
+                if _offline.get():
+                    raise RuntimeError(f'no {self.base} exchange rates are stored and they are not fetched offline')
+                self._refresh()
+            elif time.time() - self._table['fetched_at'] > self.ttl and not _offline.get():
+                self._refresh()
+            return self._table['rates']
+
+    def _refresh(self) -> None:
+        try:
+            from forex_python.converter import CurrencyRates
+            rates = CurrencyRates().get_rates(self.base)
+        except Exception as e:
+            if self._table is None or self._table['base'] != self.base:
+                raise RuntimeError(f'no {self.base} exchange rates are available: {e}') from e
+            warnings.warn(f'could not refresh exchange rates ({e}), using rates from {time.ctime(self._table["fetched_at"])}')
+            return
+
+        self._table = {'base': self.base, 'fetched_at': time.time(), 'rates': rates | {self.base: 1.0}}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.path.with_suffix('.tmp')
+        temporary_path.write_text(json.dumps(self._table))
+        temporary_path.replace(self.path)
+
+    def get_conversion_factors(self) -> dict:
+        """ get the value in the base currency of one unit of each currency (multiply by these) """
+        return {currency: 1 / rate for currency, rate in self.get_rates().items() if rate}
+
+    def get_rate(self, from_currency: str, to_currency: str=None) -> float:
+        rates = self.get_rates()
+        return rates[to_currency or self.base] / rates[from_currency]
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_rate_provider(base: str=BASE_CURRENCY) -> RateProvider:
+    """ get the shared provider for `base` (nothing is fetched until rates are asked for) """
+    with _providers_lock:
+        if base not in _providers:
+            _providers[base] = RateProvider(base=base)
+        return _providers[base]
+
+
+def configure_rate_provider(base: str=BASE_CURRENCY, **kwargs) -> RateProvider:
+    """ replace the shared provider for `base` with one built from `kwargs` (see RateProvider) """
+    with _providers_lock:
+        _providers[base] = RateProvider(base=base, **kwargs)
+        return _providers[base]
+
+
+@contextmanager
+def rates_offline():
+    """ use only the stored exchange rates in the block, however old, and never fetch them """
+    token = _offline.set(True)
+    try:
+        yield
+    finally:
+        _offline.reset(token)
@@ -1,10 +1,10 @@
-from bs4 import BeautifulSoup
-import requests
 from urllib.parse import quote_plus
 import pandas as pd
 from typing import Callable
 import re
-from tools.webscraping import get_text
+from tools.webscraping import get_text, make_soup, refilter_mask, REFILTER_MODES
+
+PARSER_VERSION = 1
 
 # TODO: figure out why goodreads only returns 5 things
 # TODO: sort by most ratings maybe? Getting some weird values otherwise
@@ -15,9 +15,9 @@ def compose_search_url(query: str) -> str:
     return search_url
 
 
-def parse_results(content: bytes) -> pd.DataFrame:
+def parse_results(content: bytes, title_refilter: str=None, author_refilter: str=None, refilter_mode: REFILTER_MODES='all') -> pd.DataFrame:
 
-    soup = BeautifulSoup(content, features='html.parser')
+    soup = make_soup(content)
 
     try:
         result_items = soup.find('table', class_='tableList').find_all('tr')
@@ -50,15 +50,36 @@ def parse_results(content: bytes) -> pd.DataFrame:
         .sort_values('num_ratings', ascending=False)
     )
 
-    # TODO: figure out how to implement this re-filtering stuff
-    # data = (data
-    #     .loc[lambda t: t.title.apply(lambda x: string_contains_all_words(x, title))]
-    #     .loc[lambda t: t.author.apply(lambda x: string_contains_all_words(x, author))]
-    # )
+    data = (data
+        .loc[lambda t: refilter_mask(t.title, title_refilter, mode=refilter_mode)]
+        .loc[lambda t: refilter_mask(t.author, author_refilter, mode=refilter_mode)]
+    )
 
     return data
 
 
+def read_library_export(export_path: str, shelves: list=None) -> pd.DataFrame:
+    """
+    Read a Goodreads library export into one row per book with a short title (no series
+    details or subtitle) and the list of shelves it is on, optionally only books on `shelves`
+    """
+    return (pd
+        .read_csv(export_path, dtype='string')
+        .assign(shelves = lambda t: (t['Bookshelves'].fillna('') + ',' + t['Exclusive Shelf'].fillna(''))
+            .str.split(r'\s*,\s*', regex=True)
+            .apply(lambda x: sorted(set(filter(None, x))))
+        )
+        .loc[lambda t: t.shelves.apply(lambda x: not shelves or bool(set(x) & set(shelves)))]
+        .assign(
+            book_id = lambda t: t['Book Id'],
+            title = lambda t: t['Title'].str.replace(r'\s+\(.*?\)', '', regex=True).str.replace(r': .*', '', regex=True),
+            author = lambda t: t['Author'].fillna(''),
+        )
+        [['book_id', 'title', 'author', 'shelves']]
+        .reset_index(drop=True)
+    )
+
+
 def string_contains_all_words(string: str, words: str) -> bool:
     words_clean = re.findall(r'\w+', words)
     return all(w.strip().lower() in string.lower() for w in words_clean)
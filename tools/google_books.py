@@ -1,27 +1,36 @@
 import re
-import requests
+import json
 import pandas as pd
-from urllib.parse import quote_plus
+from urllib.parse import quote, quote_plus
+from concurrent.futures import ThreadPoolExecutor
 from typing import Literal, get_args, Callable
-from tools.webscraping import refilter
+from tools.webscraping import refilter_mask, REFILTER_MODES, get_response_json, explode_records
 
 # DOCUMENTATION: https://developers.google.com/books/docs/v1/using#st_params
 
-def search_google_books(author: str=None, title: str=None, keywords: str=None, lang: str=None) -> pd.DataFrame:
+# only transfer the volume fields that clean_search_results and its callers use
+# (see https://developers.google.com/books/docs/v1/performance#partial-response)
+VOLUME_FIELDS = 'title,subtitle,authors,publisher,publishedDate,industryIdentifiers,pageCount,categories,averageRating,ratingsCount,language,canonicalVolumeLink'
+SEARCH_FIELDS = f'totalItems,items(volumeInfo({VOLUME_FIELDS}))'
+
+MAX_RESULTS_PER_PAGE = 40 # the most the API returns per request
+DEFAULT_CONCURRENCY = 4
+
+def search_google_books(author: str=None, title: str=None, keywords: str=None, lang: str=None, refilter_mode: REFILTER_MODES='all') -> pd.DataFrame:
     """ 
     a wrapper for simple searches - sufficient for my purposes 
     """
     query_argument = form_query_argument(keywords=keywords, intitle=title, inauthor=author)
-    search_url = form_search_url(q=query_argument, langRestrict=lang)
+    search_url = form_search_url(q=query_argument, langRestrict=lang, fields=SEARCH_FIELDS)
     json_results = get_search_results(search_url)
     results = parse_search_results(json_results)
     if results.empty:
         return pd.DataFrame()
     clean_results = clean_search_results(results)
     refiltered_results = (clean_results
-        .assign(subtitle = lambda t: t.apply(lambda r: s if (s := r.get('subtitle')) else '', axis=1))
-        .loc[lambda t: (t.title + ' ' + t.subtitle).apply(lambda x: refilter(x, title)) & 
-                       t.authors.apply(lambda x: refilter(x, author))
+        .assign(subtitle = lambda t: t['subtitle'] if 'subtitle' in t.columns else '')
+        .loc[lambda t: refilter_mask(t.title + ' ' + t.subtitle, title, mode=refilter_mode) & 
+                       refilter_mask(t.authors, author, mode=refilter_mode)
         ]
     )
     return refiltered_results
@@ -57,20 +66,21 @@ def form_search_url(
     projection: Literal["full", "lite"]=None,
     startIndex: int=None,
     volumeId: str=None,
+    fields: str=None,
 ) -> str:
     """
     Form the search url
     source: https://developers.google.com/books/docs/v1/using#st_params
     """
     kwargs = {k:v for k,v in locals().items() if v}
-    kwargs_formatted = [f'{k}={v}' for k, v in kwargs.items()]
+    kwargs_formatted = [f'{k}={quote(v, safe=",") if k == "fields" else v}' for k, v in kwargs.items()]
     query_argument = '&'.join(kwargs_formatted)
     search_url = f"https://www.googleapis.com/books/v1/volumes?" + query_argument
     return search_url
 
 
 def get_search_results(search_url: str) -> dict:
-    json_results = requests.get(search_url).json()
+    json_results = get_response_json(search_url)
     return json_results
 
 
@@ -83,18 +93,56 @@ def parse_search_results(json_results: dict) -> pd.DataFrame:
     return volumes
 
 
+def parse_results(content: bytes) -> pd.DataFrame:
+    """ parse and clean the content of a search url """
+    volumes = parse_search_results(json.loads(content))
+    return clean_search_results(volumes) if not volumes.empty else volumes
+
+
 def run_search(search_url: str) -> pd.DataFrame:
     """ run a search on the Google Books API and return raw results """
-    items = (requests
-        .get(search_url)
-        .json()
-        .get('items')
-    )
-    if items:
-        volumes = pd.DataFrame(x.get('volumeInfo') for x in items)
-    else:
-        volumes = pd.DataFrame()
-    return volumes
+    return parse_search_results(get_search_results(search_url))
+
+
+def search_all_pages(
+    q: str,
+    max_results: int=200,
+    concurrency: int=DEFAULT_CONCURRENCY,
+    fields: str=SEARCH_FIELDS,
+    **search_arguments,
+) -> pd.DataFrame:
+    """
+    Get up to `max_results` raw results for a query argument (see form_query_argument).
+    The first page gives the total number of matches and the rest are fetched concurrently.
+    """
+    page_size = min(MAX_RESULTS_PER_PAGE, max_results)
+    compose_page_url = lambda start_index: form_search_url(q=q, startIndex=start_index, maxResults=page_size, fields=fields, **search_arguments)
+
+    first_page = get_search_results(compose_page_url(0))
+    num_results = min(first_page.get('totalItems', 0), max_results)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        other_pages = list(executor.map(lambda i: get_search_results(compose_page_url(i)), range(page_size, num_results, page_size)))
+
+    volumes = [parse_search_results(x) for x in (first_page, *other_pages)]
+    return pd.concat(volumes, ignore_index=True).head(max_results)
+
+
+def lookup_isbns(isbns: list, concurrency: int=DEFAULT_CONCURRENCY, fields: str=SEARCH_FIELDS) -> pd.DataFrame:
+    """
+    Look up the first matching volume of every isbn, `concurrency` at a time, and return the
+    cleaned results with the isbn that was looked up in the 'isbn' column
+    """
+    def lookup_isbn(isbn: str) -> pd.DataFrame:
+        search_url = form_search_url(q=form_query_argument(isbn=isbn), maxResults=1, fields=fields)
+        return parse_search_results(get_search_results(search_url)).head(1).assign(isbn=isbn)
+
+    unique_isbns = list(dict.fromkeys(re.sub(r'[^\dXx]', '', str(x)) for x in isbns if x))
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = [x for x in executor.map(lookup_isbn, unique_isbns) if not x.empty]
+
+    if not results:
+        return pd.DataFrame()
+    return clean_search_results(pd.concat(results, ignore_index=True))
 
 
 def generate_isbn_getter(isbn_type: str):
@@ -111,9 +159,9 @@ def clean_search_results(results: pd.DataFrame) -> pd.DataFrame:
     isbns = (results
         .industryIdentifiers
         .dropna()
-        .explode()
-        .apply(pd.Series)
-        [['type', 'identifier']] # because the previous step may generate an empty column called 0
+        .pipe(explode_records)
+        .reindex(columns=['type', 'identifier'])
+        .dropna(subset=['type'])
         .set_index('type', append=True)
         .unstack()['identifier']
         .astype('string')
@@ -0,0 +1,58 @@
+import sys
+import time
+import builtins
+import importlib
+import threading
+
+
+class ImportProfiler:
+    """
+    Time every module imported for the first time while active.
+    Cumulative time includes the module's own imports, self time excludes them.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self._local = threading.local()
+
+    def __enter__(self):
+        self._original_import = builtins.__import__
+        self._original_import_module = importlib.import_module
+        builtins.__import__ = self._import
+        importlib.import_module = self._import_module
+        return self
+
+    def __exit__(self, *exc_info):
+        builtins.__import__ = self._original_import
+        importlib.import_module = self._original_import_module
+
+    def _timed(self, name: str, function, *args):
+        if name in sys.modules:
+            return function(*args)
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self.timings.setdefault(name, (elapsed, elapsed - children))
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level:
+            return self._original_import(name, globals, locals, fromlist, level)
+        return self._timed(name, self._original_import, name, globals, locals, fromlist, level)
+
+    def _import_module(self, name, package=None):
+        return self._timed(name, self._original_import_module, name, package)
+
+    def report(self, limit: int=25) -> str:
+        rows = sorted(self.timings.items(), key=lambda x: x[1][0], reverse=True)[:limit]
+        width = max((len(name) for name, _ in rows), default=6)
+        lines = [f"{'module':<{width}}  cumulative ms     self ms"]
+        lines += [f'{name:<{width}}  {cumulative * 1000:>13.1f}  {self_time * 1000:>10.1f}'
+                  for name, (cumulative, self_time) in rows]
+        return '\n'.join(lines)
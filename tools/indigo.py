@@ -1,19 +1,24 @@
-import requests
-from bs4 import BeautifulSoup
 from urllib.parse import quote_plus
 import pandas as pd
+from tools.webscraping import get_response_content, make_soup, refilter_mask, REFILTER_MODES
 import re
 
 # TODO: delete this temporary input line
 search_string = 'joseph smith rough stone bushman'
 
-def search_indigo(author: str=None, title: str=None, keywords: str=None) -> pd.DataFrame:
+def search_indigo(author: str=None, title: str=None, keywords: str=None, refilter_mode: REFILTER_MODES='all') -> pd.DataFrame:
     search_string = ' '.join(filter(bool, (author, title, keywords)))
     quoted_search_string = quote_plus(search_string)
     search_url = f"https://www.chapters.indigo.ca/en-ca/home/search/?keywords={quoted_search_string}#internal=1"
     print(search_url)
-    search_results_html = requests.get(search_url).content
-    soup = BeautifulSoup(search_results_html, features='html.parser')
+    search_results_html = get_response_content(search_url)
+    df_results = parse_results(search_results_html)
+    df_refiltered = df_results.loc[lambda t: refilter_mask(t.title, title, mode=refilter_mode) & refilter_mask(t.author, author, mode=refilter_mode)]
+    return df_refiltered
+
+
+def parse_results(search_results_html: bytes) -> pd.DataFrame:
+    soup = make_soup(search_results_html)
     result_items = soup.find('div', class_="product-list__results-container").find_all('div', class_="product-list__product product-list__product-container")
 
     result_items_data = []
@@ -44,16 +49,4 @@ def search_indigo(author: str=None, title: str=None, keywords: str=None) -> pd.D
         })
 
     df_results = pd.DataFrame(result_items_data)
-    df_refiltered = df_results.loc[lambda t: t.title.apply(lambda x: refilter(x, title)) & t.author.apply(lambda x: refilter(x, author))]
-    return df_refiltered
-
-    
-                    
-
-def refilter(full_string, search_string):
-    """ ensure all words in search_string appear in full_string """
-    if search_string:
-        search_words = re.findall(r'\w+', search_string)
-        return all(w.lower() in full_string.lower() for w in search_words)
-    else:
-        return True
+    return df_results
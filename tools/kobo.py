@@ -1,16 +1,19 @@
-import requests
-from bs4 import BeautifulSoup
 from urllib.parse import quote_plus
 import pandas as pd
+from tools.webscraping import get_response_content, make_soup
 
 
 def search_kobo(search_string: str) -> pd.DataFrame:
     quoted_search_string = quote_plus(search_string)
     search_url = f"https://www.kobo.com/ca/en/search?query={quoted_search_string}"
-    search_results_html = requests.get(search_url).content
-    soup = BeautifulSoup(search_results_html, features='html.parser')
+    search_results_html = get_response_content(search_url)
+    df_results = parse_results(search_results_html)
+    return df_results
+
+
+def parse_results(search_results_html: bytes) -> pd.DataFrame:
+    soup = make_soup(search_results_html)
     result_items = soup.find('ul', class_='result-items').find_all('li', class_='book')
-    print(len(result_items))
 
     result_items_data = []
     for x in result_items:
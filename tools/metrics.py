@@ -0,0 +1,110 @@
+"""
+Per search url metrics: seconds spent fetching, parsing, storing and formatting, bytes
+downloaded, rows, requests and cache hits. A record is opened around each search url and
+the fetch and parse code adds to whichever record is open in its thread, so nothing has to
+be passed through the source modules. Recording is off unless configured.
+"""
+import json
+import time
+import threading
+import contextvars
+from pathlib import Path
+from contextlib import contextmanager
+
+STAGES = ['fetch', 'parse', 'store', 'format']
+COUNTERS = ['requests', 'cache_hits', 'cache_misses', 'not_modified', 'bytes_downloaded', 'http_wait_seconds', 'rows']
+
+_current_record = contextvars.ContextVar('metrics_record', default=None)
+
+
+class MetricsRecorder:
+    """ keeps every finished record and appends each to `path` as a json line if given """
+
+    def __init__(self, path: Path=None):
+        self.path = Path(path) if path else None
+        self.records = []
+        self._lock = threading.Lock()
+
+    def add_record(self, record: dict) -> None:
+        with self._lock:
+            self.records.append(record)
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+
+    def get_summary(self):
+        """ totals per source, slowest first """
+        import pandas as pd
+        if not self.records:
+            return pd.DataFrame()
+        columns = [f'{x}_seconds' for x in STAGES] + COUNTERS
+        return (pd
+            .DataFrame(self.records)
+            .reindex(columns=['source', 'search_url', *columns])
+            .fillna({x: 0 for x in columns})
+            .groupby('source')
+            .agg(urls=('search_url', 'count'), **{x: (x, 'sum') for x in columns})
+            .assign(total_seconds = lambda t: t[[f'{x}_seconds' for x in STAGES]].sum(axis='columns'))
+            .sort_values('total_seconds', ascending=False)
+            .reset_index()
+        )
+
+
+@contextmanager
+def record(source: str, search_url: str=None, **details):
+    """ open a record for one search url of a source, finished when the block exits (even by an error) """
+    recorder = get_recorder()
+    if recorder is None:
+        yield None
+        return
+    current = {'source': source, 'search_url': search_url, 'started_at': time.time()} | details
+    token = _current_record.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current['error'] = repr(e)
+        raise
+    finally:
+        _current_record.reset(token)
+        recorder.add_record(current)
+
+
+def add(name: str, value: float=1) -> None:
+    """ add to a counter of the open record, if there is one """
+    current = _current_record.get()
+    if current is not None:
+        current[name] = current.get(name, 0) + value
+
+
+@contextmanager
+def timed(stage: str, excluding: str=None):
+    """ add the time spent in the block to `stage`, less any time added to the `excluding` stage meanwhile """
+    current = _current_record.get()
+    if current is None:
+        yield
+        return
+    excluded_before = current.get(f'{excluding}_seconds', 0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        excluded = current.get(f'{excluding}_seconds', 0) - excluded_before
+        add(f'{stage}_seconds', time.perf_counter() - start - excluded)
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder() -> MetricsRecorder:
+    """ get the shared recorder, or None if metrics are not being recorded """
+    with _recorder_lock:
+        return _recorder
+
+
+def configure_metrics(enabled: bool=True, **kwargs) -> MetricsRecorder:
+    """ start (or stop) recording to a new shared recorder built from `kwargs` (see MetricsRecorder) """
+    global _recorder
+    with _recorder_lock:
+        _recorder = MetricsRecorder(**kwargs) if enabled else None
+        return _recorder
@@ -0,0 +1,204 @@
+"""
+Group result rows from every source into works. Rows are linked when they share an ISBN,
+when their normalized title and first author's surname are the same, or when their titles
+are close and they fall in the same block (surname and first title word), so only rows in
+the same block are ever compared and matching stays close to linear in the number of rows.
+"""
+from itertools import combinations
+import numpy as np
+import pandas as pd
+
+# columns that may hold an isbn, in order of preference
+ISBN_COLUMNS = ['isbn_13', 'isbn', 'isbn_10']
+DEFAULT_SIMILARITY_THRESHOLD = 0.8
+# blocks bigger than this (e.g. a very common first word) are only matched on exact keys
+MAX_BLOCK_TITLES = 200
+
+
+def normalize_titles(titles: pd.Series) -> pd.Series:
+    """ lowercase ascii without series notes, subtitles, punctuation or a leading article """
+    return (titles
+        .fillna('')
+        .astype('string')
+        .str.normalize('NFKD')
+        .str.encode('ascii', errors='ignore')
+        .str.decode('ascii')
+        .str.lower()
+        .str.replace(r'\s*[\(\[].*?[\)\]]', '', regex=True) # e.g. (Dune, #6)
+        .str.replace(r'\s*[:;/].*$', '', regex=True)
+        .str.replace(r"[^\w\s]", '', regex=True)
+        .str.replace(r'^(?:the|a|an)\s+', '', regex=True)
+        .str.replace(r'\s+', ' ', regex=True)
+        .str.strip()
+    )
+
+
+def get_surnames(authors: pd.Series) -> pd.Series:
+    """ the surname of the first author, whether written 'First Last' or 'Last, First' """
+    first_authors = (authors
+        .fillna('')
+        .astype('string')
+        .str.normalize('NFKD')
+        .str.encode('ascii', errors='ignore')
+        .str.decode('ascii')
+        .str.lower()
+        .str.split(r';|\s+(?:and|&)\s+', regex=True).str[0]
+        .str.strip()
+    )
+    surnames = pd.Series(
+        np.where(first_authors.str.contains(','), first_authors.str.split(',').str[0], first_authors.str.split().str[-1]),
+        index=authors.index,
+    )
+    return surnames.fillna('').str.replace(r'[^\w]', '', regex=True)
+
+
+def isbn10_to_isbn13(isbn10: str) -> str:
+    core = '978' + isbn10[:9]
+    check_digit = (10 - sum((3 if i % 2 else 1) * int(x) for i, x in enumerate(core)) % 10) % 10
+    return core + str(check_digit)
+
+
+def get_isbn13s(df_results: pd.DataFrame) -> pd.Series:
+    """ the first isbn of each row from any of the ISBN_COLUMNS, as isbn-13 (missing if there is none) """
+    isbns = pd.Series(pd.NA, index=df_results.index, dtype='string')
+    for column in ISBN_COLUMNS:
+        if column in df_results.columns:
+            cleaned = df_results[column].astype('string').str.replace(r'[^\dXx]', '', regex=True).str.upper()
+            isbns = isbns.fillna(cleaned.mask(cleaned.eq('')))
+    is_isbn10 = isbns.str.fullmatch(r'\d{9}[\dX]').fillna(False).astype('bool')
+    isbns[is_isbn10] = isbns[is_isbn10].map(isbn10_to_isbn13)
+    return isbns.where(isbns.str.fullmatch(r'\d{13}').fillna(False).astype('bool'))
+
+
+def title_similarity(a: str, b: str) -> float:
+    """ share of the words of either title that are in both """
+    words_a, words_b = set(a.split()), set(b.split())
+    return len(words_a & words_b) / len(words_a | words_b) if words_a or words_b else 0.0
+
+
+class DisjointSet:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> None:
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    def union_groups(self, groups) -> None:
+        for members in groups:
+            for member in members[1:]:
+                self.union(members[0], member)
+
+
+def resolve_works(df_results: pd.DataFrame, similarity_threshold: float=DEFAULT_SIMILARITY_THRESHOLD) -> pd.DataFrame:
+    """ add a 'work_id' to rows with title and author columns (and isbns where the source has them) """
+    if df_results.empty:
+        return df_results.assign(work_id=pd.Series(dtype='int'))
+
+    df_keys = pd.DataFrame({
+        'isbn13': get_isbn13s(df_results).to_numpy(),
+        'title_key': normalize_titles(df_results['title']).to_numpy(),
+        'surname': get_surnames(df_results['author']).to_numpy() if 'author' in df_results.columns else '',
+    })
+    df_keys['work_key'] = df_keys.surname + '|' + df_keys.title_key
+    df_keys['block'] = df_keys.surname + '|' + df_keys.title_key.str.split().str[0].fillna('')
+
+    works = DisjointSet(len(df_keys))
+    for df_keyed, key in ((df_keys.dropna(subset=['isbn13']), 'isbn13'), (df_keys.loc[lambda t: t.title_key.ne('')], 'work_key')):
+        rows = df_keyed.index.to_numpy()
+        works.union_groups(rows[x] for x in df_keyed.groupby(key).indices.values())
+
+    # close but not identical titles, compared only within a block and once per distinct title
+    first_rows = df_keys.loc[lambda t: t.title_key.ne('')].drop_duplicates('work_key')
+    for block_rows in first_rows.groupby('block').indices.values():
+        if not 1 < len(block_rows) <= MAX_BLOCK_TITLES:
+            continue
+        titles = first_rows.title_key.to_numpy()[block_rows]
+        rows = first_rows.index.to_numpy()[block_rows]
+        for i, j in combinations(range(len(rows)), 2):
+            if title_similarity(titles[i], titles[j]) >= similarity_threshold:
+                works.union(rows[i], rows[j])
+
+    roots = [works.find(i) for i in range(len(df_keys))]
+    return df_results.assign(work_id=pd.factorize(pd.Series(roots))[0], isbn13=df_keys.isbn13.to_numpy())
+
+
+def get_most_common(df: pd.DataFrame, column: str) -> pd.Series:
+    """ the most common value of `column` per work """
+    return (df
+        .dropna(subset=[column])
+        .groupby(['work_id', column], sort=False)
+        .size()
+        .sort_values(ascending=False, kind='stable')
+        .reset_index()
+        .drop_duplicates('work_id')
+        .set_index('work_id')
+        [column]
+    )
+
+
+def join_unique(df: pd.DataFrame, column: str) -> pd.Series:
+    """ the distinct values of `column` per work, sorted and comma separated """
+    return (df
+        .dropna(subset=[column])
+        .assign(**{column: lambda t: t[column].astype('str')})
+        .loc[lambda t: t[column].ne('')]
+        .drop_duplicates(['work_id', column])
+        .sort_values(column)
+        .groupby('work_id')
+        [column]
+        .agg(', '.join)
+    )
+
+
+def summarize_works(df_resolved: pd.DataFrame, to_cad_factors: dict=None) -> pd.DataFrame:
+    """
+    One 'where can I get this' row per work: what each source has, using whichever of the
+    source columns are present (goodreads ratings, abebooks prices, library formats and
+    holds, anna's archive file types). Pass `to_cad_factors` to compare prices in CAD.
+    """
+    if df_resolved.empty:
+        return pd.DataFrame()
+
+    df = df_resolved.reset_index(drop=True)
+    df_works = pd.DataFrame({
+        'title': get_most_common(df, 'title'),
+        'author': get_most_common(df, 'author') if 'author' in df.columns else None,
+        'isbn13': join_unique(df, 'isbn13'),
+        'sources': join_unique(df, 'source') if 'source' in df.columns else None,
+        'rows': df.groupby('work_id').size(),
+    }, index=pd.Index(df.work_id.unique(), name='work_id'))
+
+    if 'avg_rating' in df.columns:
+        df_rated = df.dropna(subset=['avg_rating']).sort_values('num_ratings')
+        df_works['rating'] = df_rated.groupby('work_id').avg_rating.last()
+        df_works['num_ratings'] = df_rated.groupby('work_id').num_ratings.last()
+
+    if 'price' in df.columns:
+        df_for_sale = df.dropna(subset=['price'])
+        df_works['copies_for_sale'] = df_for_sale.groupby('work_id').size()
+        if to_cad_factors:
+            total_price_cad = (df_for_sale.price * df_for_sale.currency.map(to_cad_factors)
+                               + df_for_sale.shipping_cost.fillna(0) * df_for_sale.shipping_currency.fillna(df_for_sale.currency).map(to_cad_factors))
+            df_works['lowest_total_cad'] = total_price_cad.groupby(df_for_sale.work_id).min().round(2)
+
+    if 'true_format' in df.columns:
+        df_held = df.dropna(subset=['true_format'])
+        df_works['library_formats'] = join_unique(df_held, 'true_format')
+        holds = df_held.hold_counts.str.extract(r'(\d+)', expand=False).astype('float')
+        df_works['fewest_holds'] = holds.groupby(df_held.work_id).min()
+
+    if 'filetype' in df.columns:
+        df_works['ebook_files'] = join_unique(df, 'filetype')
+
+    return (df_works
+        .sort_values(['rows', 'title'], ascending=[False, True])
+        .reset_index()
+    )
@@ -0,0 +1,154 @@
+import time
+import random
+import threading
+from typing import Callable
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+
+# (requests per second, burst size) allowed per host, matched against the end of the host
+HOST_RATE_LIMITS = {
+    'goodreads.com': (1.0, 3),
+    'abebooks.com': (1.0, 3),
+    'bibliocommons.com': (2.0, 4),
+    'annas-archive.org': (0.5, 2),
+    'googleapis.com': (5.0, 10),
+    'chapters.indigo.ca': (1.0, 2),
+    'kobo.com': (1.0, 2),
+}
+DEFAULT_RATE_LIMIT = (2.0, 4)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_BASE_SECONDS = 1.0
+DEFAULT_BACKOFF_MAX_SECONDS = 60.0
+
+
+class FetchError(Exception):
+    """ a request that still failed after all its retries, as opposed to a search with no results """
+
+    def __init__(self, url: str, status: int=None, reason: str=''):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        super().__init__(f"{status or 'no response'} {reason} from {url}".replace('  ', ' '))
+
+
+class TokenBucket:
+    """ allow `rate` requests per second on average with bursts of up to `capacity` """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """ block until a request may be sent """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """ hold back every request to this host, e.g. when it sends Retry-After """
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class RequestScheduler:
+    """
+    Send requests at no more than each host's rate limit, retrying connection errors and
+    retryable statuses with exponential backoff and jitter (or the host's Retry-After).
+    """
+
+    def __init__(
+        self,
+        host_rate_limits: dict=HOST_RATE_LIMITS,
+        max_retries: int=DEFAULT_MAX_RETRIES,
+        backoff_base: float=DEFAULT_BACKOFF_BASE_SECONDS,
+        backoff_max: float=DEFAULT_BACKOFF_MAX_SECONDS,
+    ):
+        self.host_rate_limits = host_rate_limits
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def get_bucket(self, url: str) -> TokenBucket:
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._buckets:
+                rate_limit = next((x for suffix, x in self.host_rate_limits.items() if host == suffix or host.endswith('.' + suffix)), DEFAULT_RATE_LIMIT)
+                self._buckets[host] = TokenBucket(*rate_limit)
+            return self._buckets[host]
+
+    def get_backoff(self, attempt: int) -> float:
+        """ full jitter: anywhere up to the exponential backoff for this attempt """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def get_retry_after(self, response) -> float:
+        retry_after = response.headers.get('Retry-After')
+        if not retry_after:
+            return None
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            try:
+                seconds = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(max(seconds, 0.0), self.backoff_max)
+
+    def send(self, url: str, send_request: Callable):
+        """ call `send_request()` for `url` under the host's rate limit, retrying as needed """
+        bucket = self.get_bucket(url)
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            try:
+                response = send_request()
+            except OSError as e: # requests' connection errors and timeouts are OSErrors
+                error = FetchError(url, reason=repr(e))
+                delay = self.get_backoff(attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    if response.status_code >= 400:
+                        raise FetchError(url, response.status_code, response.reason)
+                    return response
+                error = FetchError(url, response.status_code, response.reason)
+                retry_after = self.get_retry_after(response)
+                if retry_after is not None:
+                    bucket.pause(retry_after)
+                delay = retry_after if retry_after is not None else self.get_backoff(attempt)
+
+            if attempt == self.max_retries:
+                raise error
+            time.sleep(delay)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
+
+
+def configure_scheduler(**kwargs) -> RequestScheduler:
+    """ replace the shared scheduler with one built from `kwargs` (see RequestScheduler) """
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = RequestScheduler(**kwargs)
+        return _scheduler
@@ -0,0 +1,150 @@
+"""
+A long-running local search server, so the interpreter, imports, connection pools, caches
+and exchange rates stay warm between searches, and the thin client that forwards queries
+to it. Searches are GET /search?title=..&author=..&sources=a,b (or POST /search with the
+same fields as a json object) and come back as json.
+"""
+import sys
+import json
+import time
+import threading
+from typing import Callable
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_MEMO_SIZE = 256
+
+# the search fields a request may set and how to read them from a query string
+SEARCH_FIELDS = {
+    'title': str,
+    'author': str,
+    'sources': lambda x: [y for y in x.split(',') if y],
+    'libraries': lambda x: [y for y in x.split(',') if y],
+    'max_results': int,
+    'max_price': float,
+    'timeout': float,
+    'offline': lambda x: x.lower() in ('1', 'true', 'yes'),
+}
+
+
+class ResponseMemo:
+    """ recent search responses kept in memory until their `expires_at` """
+
+    def __init__(self, max_size: int=DEFAULT_MEMO_SIZE):
+        self.max_size = max_size
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(request: dict) -> str:
+        return json.dumps(request, sort_keys=True)
+
+    def get(self, request: dict) -> dict:
+        key = self.make_key(request)
+        with self._lock:
+            entry = self._responses.get(key)
+            if not entry or time.time() > entry[0]:
+                return None
+            self._responses.move_to_end(key)
+            return entry[1]
+
+    def set(self, request: dict, response: dict, expires_at: float) -> None:
+        key = self.make_key(request)
+        with self._lock:
+            self._responses[key] = (expires_at, response)
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.max_size:
+                self._responses.popitem(last=False)
+
+
+def read_search_request(query_string: str=None, body: bytes=None) -> dict:
+    """ the search fields of a query string or json body, checking their types """
+    if body:
+        fields = json.loads(body)
+        if not isinstance(fields, dict):
+            raise ValueError('the request body must be a json object')
+    else:
+        fields = {k: SEARCH_FIELDS[k](v) if k in SEARCH_FIELDS else v for k, v in parse_qsl(query_string or '')}
+    unknown = set(fields) - set(SEARCH_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown fields {sorted(unknown)}, choose from {list(SEARCH_FIELDS)}")
+    return {k: v for k, v in fields.items() if v not in (None, '', [])}
+
+
+def make_handler(search: Callable, list_sources: Callable, memo: ResponseMemo, quiet: bool=False):
+    """
+    A request handler that answers /search with `search(request)`, which returns the
+    response and the time it may be reused until, /sources with `list_sources()` and /health
+    """
+
+    class SearchRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' # keep-alive, so a client can reuse its connection
+
+        def do_GET(self):
+            self.handle_request()
+
+        def do_POST(self):
+            self.handle_request(self.rfile.read(int(self.headers.get('Content-Length') or 0)))
+
+        def handle_request(self, body: bytes=None):
+            parts = urlsplit(self.path)
+            try:
+                if parts.path == '/search':
+                    request = read_search_request(parts.query, body)
+                    response = memo.get(request)
+                    if response is None:
+                        response, expires_at = search(request)
+                        memo.set(request, response, expires_at)
+                    self.send_json(200, response)
+                elif parts.path == '/sources':
+                    self.send_json(200, {'sources': list_sources()})
+                elif parts.path == '/health':
+                    self.send_json(200, {'status': 'ok'})
+                else:
+                    self.send_json(404, {'error': f'no such endpoint {parts.path}, use /search, /sources or /health'})
+            except (ValueError, TypeError) as e:
+                self.send_json(400, {'error': str(e)})
+            except Exception as e:
+                self.send_json(500, {'error': repr(e)})
+
+        def send_json(self, status: int, content: dict):
+            encoded = json.dumps(content).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(encoded)))
+            self.end_headers()
+            self.wfile.write(encoded)
+
+        def log_message(self, format, *args):
+            if not quiet:
+                super().log_message(format, *args)
+
+    return SearchRequestHandler
+
+
+def serve(search: Callable, list_sources: Callable, host: str=DEFAULT_HOST, port: int=DEFAULT_PORT, memo_size: int=DEFAULT_MEMO_SIZE, quiet: bool=False) -> None:
+    """ answer searches until interrupted, each on its own thread """
+    handler = make_handler(search, list_sources, ResponseMemo(memo_size), quiet=quiet)
+    with ThreadingHTTPServer((host, port), handler) as server:
+        server.daemon_threads = True
+        print(f'serving searches on http://{host}:{port}/search', file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def query_server(server_url: str, request: dict, timeout: float=None) -> dict:
+    """ send a search to a running server and return its response """
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+
+    query_string = urlencode({k: ','.join(v) if isinstance(v, list) else v for k, v in request.items() if v not in (None, '', [])})
+    try:
+        with urlopen(f"{server_url.rstrip('/')}/search?{query_string}", timeout=timeout) as response:
+            return json.loads(response.read())
+    except HTTPError as e:
+        raise RuntimeError(f"the server refused the search: {json.loads(e.read()).get('error')}") from e
@@ -0,0 +1,175 @@
+"""
+Registry of the sources booksearch can search. A source's module is only imported when
+that source is used, so parsing arguments or selecting one source stays cheap.
+"""
+import os
+import importlib
+import threading
+from typing import Callable
+
+SOURCES = {}
+
+
+def register_source(name: str, module: str, compose: Callable, description: str='', fetch_limited: Callable=None, parse: Callable=None) -> None:
+    """
+    Add a source to the registry.
+    `module` is the import path of a module with a `parse_results(content)` function and
+    `compose` is called as compose(module, title, author) to get the source's search urls.
+    Sources whose parser can drop results that don't match the search pass `parse`, called as
+    parse(module, content, title=, author=) instead of parse_results(content).
+    Sources that can page through results pass `fetch_limited`, called as
+    fetch_limited(module, search_url, max_results=, max_price=, timeout=) when a limit is set.
+    A module can set PARSER_VERSION, bumped whenever parse_results returns something different,
+    so `booksearch reparse` knows which archived responses to parse again.
+    """
+    SOURCES[name] = {
+        "name": name,
+        "module": module,
+        "compose": compose,
+        "description": description,
+        "fetch_limited": fetch_limited,
+        "parse": parse or (lambda m, content, title, author: m.parse_results(content)),
+    }
+
+
+def list_sources() -> list:
+    return list(SOURCES)
+
+
+def load_source_module(name: str):
+    return importlib.import_module(SOURCES[name]['module'])
+
+
+def compose_search_urls(name: str, title: str=None, author: str=None) -> list:
+    return SOURCES[name]['compose'](load_source_module(name), title=title, author=author)
+
+
+def get_parser_version(name: str) -> int:
+    return getattr(load_source_module(name), 'PARSER_VERSION', 1)
+
+
+def parse_content(name: str, content: bytes, title: str=None, author: str=None):
+    return SOURCES[name]['parse'](load_source_module(name), content, title=title, author=author)
+
+
+def parse_content_serialized(name: str, content: bytes, title: str=None, author: str=None) -> tuple:
+    """ parse in a worker process, sending back the frame as split json and its dtypes rather than pickled objects """
+    df_results = parse_content(name, content, title=title, author=author)
+    return df_results.to_json(orient='split'), {k: str(v) for k, v in df_results.dtypes.items()}
+
+
+def parse_content_in_pool(name: str, content: bytes, title: str=None, author: str=None):
+    """ parse in the shared process pool if there is one, otherwise in this thread """
+    pool = get_parse_pool()
+    if pool is None:
+        return parse_content(name, content, title=title, author=author)
+
+    import pandas as pd
+    from io import StringIO
+    serialized, dtypes = pool.submit(parse_content_serialized, name, content, title=title, author=author).result()
+    df_results = pd.read_json(StringIO(serialized), orient='split', dtype=False, convert_dates=False)
+    return df_results.astype({k: v for k, v in dtypes.items() if k in df_results.columns and v != 'object'})
+
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def get_parse_pool():
+    """ get the shared parse process pool, or None if parsing happens in the calling thread """
+    with _parse_pool_lock:
+        return _parse_pool
+
+
+def configure_parse_pool(workers: int=0):
+    """
+    Parse in a pool of `workers` processes (0 to parse in the calling thread), shutting down
+    any previous pool. Call it from the main thread: the workers are started here rather than
+    on the first submit from a fetch thread, and from a forkserver rather than by forking this
+    process, whose other threads may be holding locks (connection pools, sqlite) at the time.
+    """
+    global _parse_pool
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, wait
+    from tools.webscraping import get_parser_backend, set_parser_backend
+
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown()
+        _parse_pool = None
+        if workers:
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            # workers import the source modules themselves (plugins come from the same environment)
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=set_parser_backend,
+                initargs=(get_parser_backend(),),
+            )
+            wait([_parse_pool.submit(int) for _ in range(workers)])
+        return _parse_pool
+
+
+def fetch_results(name: str, search_url: str, query: str=None, title: str=None, author: str=None, timeout: float=None, max_results: int=None, max_price: float=None):
+    """
+    Fetch and parse one search url of a source, keeping the rows in the result store.
+    Sources that support it drop rows that don't match the searched `title` and `author` and
+    stop fetching pages at `max_results` rows or `max_price` (CAD).
+    """
+    from tools.webscraping import get_response_content
+    from tools.store import get_store
+    from tools.archive import archiving
+    import tools.metrics as metrics
+
+    fetch_limited = SOURCES[name]['fetch_limited']
+    with archiving(name, search_url, query=query, title=title, author=author, parser_version=get_parser_version(name)):
+        if fetch_limited and (max_results or max_price is not None):
+            # pages are fetched and parsed in turn, so the parse time is what is left after fetching
+            with metrics.timed('parse', excluding='fetch'):
+                df_results = fetch_limited(load_source_module(name), search_url, max_results=max_results, max_price=max_price, timeout=timeout)
+        else:
+            content = get_response_content(search_url, timeout=timeout)
+            with metrics.timed('parse'):
+                df_results = parse_content_in_pool(name, content, title=title, author=author)
+    metrics.add('rows', len(df_results))
+    if store := get_store():
+        with metrics.timed('store'):
+            store.save(name, query, search_url, df_results)
+    return df_results
+
+
+def join_query(title: str=None, author: str=None) -> str:
+    return ' '.join(x for x in (title, author) if x)
+
+
+register_source(
+    'goodreads',
+    module='tools.goodreads',
+    compose=lambda m, title, author: [m.compose_search_url(query=join_query(title, author))],
+    description='ratings',
+    parse=lambda m, content, title, author: m.parse_results(content, title_refilter=title, author_refilter=author),
+)
+register_source(
+    'abebooks',
+    module='tools.abebooks',
+    compose=lambda m, title, author: [m.compose_search_url(title=title, author=author)],
+    description='used copies for sale',
+    fetch_limited=lambda m, search_url, **limits: m.fetch_listings(search_url, **limits),
+)
+register_source(
+    'library',
+    module='tools.bibliocommons',
+    compose=lambda m, title, author: m.compose_search_urls(title=title, author=author),
+    description='library holdings',
+)
+register_source(
+    'annas',
+    module='tools.annas_archive',
+    compose=lambda m, title, author: [m.compose_search_url(query=join_query(title, author))],
+    description='ebook files',
+)
+
+
+# extra sources: comma-separated modules that call register_source when imported
+for plugin in filter(None, os.environ.get('BOOKSEARCH_PLUGINS', '').split(',')):
+    importlib.import_module(plugin.strip())
@@ -0,0 +1,107 @@
+"""
+A local database of every parsed search result, with a full-text index on title, author
+and publisher so earlier results can be searched again without the network.
+"""
+import re
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+import pandas as pd
+from tools.cache import DATA_DIR
+
+STORE_PATH = DATA_DIR / 'results.sqlite'
+
+# the columns every source's rows are normalized to (missing ones are left empty)
+INDEXED_COLUMNS = ['title', 'author', 'publisher']
+
+
+class ResultStore:
+    """ parsed result rows keyed by the source and search url they came from """
+
+    def __init__(self, path: Path=STORE_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY,
+                source TEXT NOT NULL,
+                query TEXT NOT NULL,
+                search_url TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                title TEXT NOT NULL,
+                author TEXT NOT NULL,
+                publisher TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS results_search_url ON results (source, search_url);
+            CREATE VIRTUAL TABLE IF NOT EXISTS results_fts USING fts5 (
+                title, author, publisher, content='results', content_rowid='id'
+            );
+            CREATE TRIGGER IF NOT EXISTS results_insert AFTER INSERT ON results BEGIN
+                INSERT INTO results_fts (rowid, title, author, publisher) VALUES (new.id, new.title, new.author, new.publisher);
+            END;
+            CREATE TRIGGER IF NOT EXISTS results_delete AFTER DELETE ON results BEGIN
+                INSERT INTO results_fts (results_fts, rowid, title, author, publisher) VALUES ('delete', old.id, old.title, old.author, old.publisher);
+            END;
+        """)
+
+    def save(self, source: str, query: str, search_url: str, df_results: pd.DataFrame) -> None:
+        """ replace the stored rows of a search url with its latest results """
+        now = time.time()
+        records = json.loads(df_results.to_json(orient='records'))
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM results WHERE source = ? AND search_url = ?', (source, search_url))
+            self._connection.executemany(
+                'INSERT INTO results (source, query, search_url, fetched_at, title, author, publisher, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(source, query or '', search_url, now, *(str(x.get(c) or '') for c in INDEXED_COLUMNS), json.dumps(x))
+                 for x in records],
+            )
+
+    def search(self, query: str, sources: list=None, limit: int=1000) -> pd.DataFrame:
+        """ find stored rows whose title, author or publisher contain every word of `query`, best matches first """
+        words = re.findall(r'\w+', query)
+        if not words:
+            return pd.DataFrame()
+        match_expression = ' '.join('"' + w.replace('"', '""') + '"' for w in words)
+        source_filter = f"AND results.source IN ({','.join('?' * len(sources))})" if sources else ''
+        with self._lock:
+            rows = self._connection.execute(
+                f"""
+                SELECT results.source, results.search_url, results.fetched_at, results.data
+                FROM results_fts JOIN results ON results.id = results_fts.rowid
+                WHERE results_fts MATCH ? {source_filter}
+                ORDER BY bm25(results_fts)
+                LIMIT ?
+                """,
+                (match_expression, *(sources or []), limit),
+            ).fetchall()
+        return pd.DataFrame(
+            {'source': source, 'search_url': search_url, 'fetched_at': fetched_at} | json.loads(data)
+            for source, search_url, fetched_at, data in rows
+        )
+
+
+_store = None
+_store_enabled = True
+_store_lock = threading.Lock()
+
+
+def get_store() -> ResultStore:
+    """ get the shared store (created in DATA_DIR on first use), or None if it is disabled """
+    global _store
+    with _store_lock:
+        if _store_enabled and _store is None:
+            _store = ResultStore()
+        return _store if _store_enabled else None
+
+
+def configure_store(enabled: bool=True, **kwargs) -> ResultStore:
+    """ turn the shared store on or off, or rebuild it from `kwargs` (see ResultStore) """
+    global _store, _store_enabled
+    with _store_lock:
+        _store_enabled = enabled
+        _store = ResultStore(**kwargs) if enabled else None
+        return _store
@@ -0,0 +1,147 @@
+"""
+Keep the availability of shelved Goodreads books up to date. Each export is compared with
+the books seen last time, and only new books or ones whose last check per source is older
+than that source's maximum age are searched again.
+"""
+import sys
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+from tools.cache import DATA_DIR, DAY
+from tools.batch import search_query_source
+
+STATE_PATH = DATA_DIR / 'toread.sqlite'
+DEFAULT_SHELVES = ['to-read', 'own', 'own-epub']
+DEFAULT_CONCURRENCY = 4
+
+# how long a check of each source stays good for
+SOURCE_MAX_AGE_SECONDS = {
+    'library': DAY,
+    'abebooks': 7 * DAY,
+    'goodreads': 30 * DAY,
+    'annas': 30 * DAY,
+}
+DEFAULT_MAX_AGE_SECONDS = 7 * DAY
+
+
+class ToReadState:
+    """ the shelved books seen in previous exports and the last check of each per source """
+
+    def __init__(self, path: Path=STATE_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS books (
+                book_id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                author TEXT NOT NULL,
+                shelves TEXT NOT NULL,
+                added_at REAL NOT NULL,
+                removed_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS checks (
+                book_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                checked_at REAL NOT NULL,
+                num_rows INTEGER NOT NULL,
+                results TEXT NOT NULL,
+                PRIMARY KEY (book_id, source)
+            );
+        """)
+
+    def sync_books(self, df_books: pd.DataFrame) -> dict:
+        """ record which books were added to or removed from the shelves since the last export """
+        now = time.time()
+        with self._lock, self._connection:
+            active_ids = {x for x, in self._connection.execute('SELECT book_id FROM books WHERE removed_at IS NULL')}
+            export_ids = set(df_books.book_id)
+            added = export_ids - active_ids
+            removed = active_ids - export_ids
+            self._connection.executemany(
+                """
+                INSERT INTO books VALUES (?, ?, ?, ?, ?, NULL)
+                ON CONFLICT (book_id) DO UPDATE SET title = excluded.title, author = excluded.author, shelves = excluded.shelves,
+                    added_at = CASE WHEN books.removed_at IS NULL THEN books.added_at ELSE excluded.added_at END, removed_at = NULL
+                """,
+                [(x.book_id, x.title, x.author, ','.join(x.shelves), now) for x in df_books.itertuples()],
+            )
+            self._connection.executemany('UPDATE books SET removed_at = ? WHERE book_id = ?', [(now, x) for x in removed])
+        return {'added': sorted(added), 'removed': sorted(removed)}
+
+    def get_due_checks(self, sources: list, max_age_seconds: float=None) -> list:
+        """ get the (book_id, title, author, source) of every shelved book whose check of a source is missing or stale """
+        now = time.time()
+        with self._lock:
+            books = self._connection.execute('SELECT book_id, title, author FROM books WHERE removed_at IS NULL').fetchall()
+            checked_at = {(book_id, source): x for book_id, source, x in self._connection.execute('SELECT book_id, source, checked_at FROM checks')}
+        return [
+            (book_id, title, author, source)
+            for book_id, title, author in books
+            for source in sources
+            if now - checked_at.get((book_id, source), 0) > (max_age_seconds or SOURCE_MAX_AGE_SECONDS.get(source, DEFAULT_MAX_AGE_SECONDS))
+        ]
+
+    def record_check(self, book_id: str, source: str, df_results: pd.DataFrame) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO checks VALUES (?, ?, ?, ?, ?)',
+                (book_id, source, time.time(), len(df_results), df_results.to_json(orient='records')),
+            )
+
+    def get_summary(self) -> pd.DataFrame:
+        """ number of results per source for every shelved book """
+        with self._lock:
+            df_checks = pd.read_sql(
+                """
+                SELECT books.title, books.author, checks.source, checks.num_rows
+                FROM books JOIN checks USING (book_id)
+                WHERE books.removed_at IS NULL
+                """,
+                self._connection,
+            )
+        if df_checks.empty:
+            return df_checks
+        return df_checks.pivot_table(index=['title', 'author'], columns='source', values='num_rows', aggfunc='sum').reset_index()
+
+    def get_results(self, book_id: str, source: str) -> pd.DataFrame:
+        with self._lock:
+            row = self._connection.execute('SELECT results FROM checks WHERE book_id = ? AND source = ?', (book_id, source)).fetchone()
+        return pd.DataFrame(json.loads(row[0])) if row else pd.DataFrame()
+
+
+def refresh(
+    export_path: Path,
+    sources: list,
+    state: ToReadState,
+    shelves: list=DEFAULT_SHELVES,
+    max_age_seconds: float=None,
+    concurrency: int=DEFAULT_CONCURRENCY,
+    timeout: float=None,
+) -> None:
+    """ sync the shelves from a goodreads export and run only the checks that are new or stale """
+    from tools.goodreads import read_library_export
+
+    changes = state.sync_books(read_library_export(export_path, shelves=shelves))
+    print(f"{len(changes['added'])} books added and {len(changes['removed'])} removed since the last export", file=sys.stderr)
+
+    due_checks = state.get_due_checks(sources, max_age_seconds=max_age_seconds)
+    print(f'{len(due_checks)} checks are new or stale', file=sys.stderr)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(search_query_source, title, author, source, timeout=timeout): (book_id, title, source)
+                   for book_id, title, author, source in due_checks}
+        for i, future in enumerate(as_completed(futures), start=1):
+            book_id, title, source = futures[future]
+            try:
+                df_results = future.result()
+            except Exception as e:
+                # left stale, so it is retried on the next refresh
+                print(f'[{i}/{len(due_checks)}] {source}: {title} failed: {e}', file=sys.stderr)
+                continue
+            state.record_check(book_id, source, df_results)
+            print(f'[{i}/{len(due_checks)}] {source}: {title} {len(df_results)} rows', file=sys.stderr)
@@ -0,0 +1,229 @@
+"""
+Watch the library holds of a list of books. Every round re-checks each book at each library,
+re-parses only the pages whose content changed since the last round and reports only the
+holdings whose availability or hold count changed. Hold counts are kept over time to
+estimate how long a hold placed now would wait.
+"""
+import re
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+from tools.cache import DATA_DIR, HOUR, DAY
+from tools.webscraping import get_response_content
+import tools.bibliocommons as bibliocommons
+
+STATE_PATH = DATA_DIR / 'watch.sqlite'
+DEFAULT_INTERVAL_SECONDS = HOUR
+DEFAULT_CONCURRENCY = 8
+# how long each copy is assumed to be out while there is no history of the queue moving
+LOAN_PERIOD_DAYS = 21
+
+HOLDING_COLUMNS = ['title', 'author', 'format', 'availability_status', 'holds', 'copies']
+
+
+class WatchState:
+    """ the last content seen at each search url, the current holdings and their hold count history """
+
+    def __init__(self, path: Path=STATE_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                search_url TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                checked_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS holdings (
+                holding_key TEXT PRIMARY KEY,
+                search_url TEXT NOT NULL,
+                library TEXT NOT NULL,
+                title TEXT NOT NULL,
+                author TEXT NOT NULL,
+                format TEXT NOT NULL,
+                availability_status TEXT NOT NULL,
+                holds INTEGER,
+                copies INTEGER,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS holdings_search_url ON holdings (search_url);
+            CREATE TABLE IF NOT EXISTS hold_history (
+                holding_key TEXT NOT NULL,
+                checked_at REAL NOT NULL,
+                holds INTEGER NOT NULL,
+                PRIMARY KEY (holding_key, checked_at)
+            );
+        """)
+
+    def is_unchanged(self, search_url: str, content_hash: str) -> bool:
+        with self._lock:
+            row = self._connection.execute('SELECT content_hash FROM pages WHERE search_url = ?', (search_url,)).fetchone()
+        return bool(row) and row[0] == content_hash
+
+    def update_page(self, search_url: str, library: str, content_hash: str, df_holdings: pd.DataFrame) -> list:
+        """ replace the holdings found at a search url, returning the ones that are new, gone or changed """
+        now = time.time()
+        with self._lock, self._connection:
+            previous = {
+                x[0]: dict(zip(HOLDING_COLUMNS, x[1:]))
+                for x in self._connection.execute(f"SELECT holding_key, {', '.join(HOLDING_COLUMNS)} FROM holdings WHERE search_url = ?", (search_url,))
+            }
+            current = {
+                make_holding_key(search_url, x): x | {c: None if pd.isna(x[c]) else int(x[c]) for c in ('holds', 'copies')}
+                for x in df_holdings.to_dict(orient='records')
+            }
+
+            changes = []
+            for holding_key, x in current.items():
+                before = previous.get(holding_key)
+                if before is None:
+                    change = 'new'
+                elif before['availability_status'] != x['availability_status']:
+                    change = f"was {before['availability_status'] or 'unknown'}"
+                elif before['holds'] != x['holds']:
+                    change = f"holds {before['holds']} -> {x['holds']}"
+                else:
+                    continue
+                changes.append(x | {'library': library, 'change': change, 'holding_key': holding_key})
+            changes.extend(x | {'library': library, 'change': 'gone', 'holding_key': holding_key}
+                           for holding_key, x in previous.items() if holding_key not in current)
+
+            self._connection.execute('DELETE FROM holdings WHERE search_url = ?', (search_url,))
+            self._connection.executemany(
+                f"INSERT INTO holdings (holding_key, search_url, library, {', '.join(HOLDING_COLUMNS)}, updated_at) VALUES ({', '.join('?' * (len(HOLDING_COLUMNS) + 4))})",
+                [(holding_key, search_url, library, *(x[c] for c in HOLDING_COLUMNS), now) for holding_key, x in current.items()],
+            )
+            # the history only needs the points where the count moved
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO hold_history VALUES (?, ?, ?)',
+                [(x['holding_key'], now, x['holds']) for x in changes if x['change'] != 'gone' and x['holds'] is not None],
+            )
+            self._connection.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?)', (search_url, content_hash, now))
+        return changes
+
+    def get_hold_history(self, holding_key: str) -> list:
+        """ (checked_at, holds) of a holding, oldest first """
+        with self._lock:
+            return self._connection.execute('SELECT checked_at, holds FROM hold_history WHERE holding_key = ? ORDER BY checked_at', (holding_key,)).fetchall()
+
+
+def make_holding_key(search_url: str, holding: dict) -> str:
+    return json.dumps([search_url, holding['title'], holding['author'], holding['format']])
+
+
+def get_holdings(df_results: pd.DataFrame) -> pd.DataFrame:
+    """ one row per title, author and format of parsed bibliocommons results, adding up the holds and copies of its editions """
+    if df_results.empty:
+        return pd.DataFrame(columns=HOLDING_COLUMNS)
+    df_results = df_results.reset_index(drop=True) # parsed results repeat the index of each item for its formats
+    hold_counts = df_results.hold_counts.str.extract(r'(?P<holds>\d+)\D+?(?P<copies>\d+)\s+cop', flags=re.IGNORECASE).astype('float')
+    return (df_results
+        .join(hold_counts)
+        .rename(columns={'true_format': 'format'})
+        .fillna({'title': '', 'author': '', 'format': '', 'availability_status': ''})
+        .groupby(['title', 'author', 'format'], as_index=False)
+        .agg(
+            availability_status = ('availability_status', lambda x: '; '.join(sorted(set(x) - {''}))),
+            holds = ('holds', lambda x: x.sum(min_count=1)),
+            copies = ('copies', lambda x: x.sum(min_count=1)),
+        )
+        [HOLDING_COLUMNS]
+    )
+
+
+def estimate_wait_days(history: list, holds: int, copies: int, availability_status: str='', now: float=None) -> float:
+    """
+    Days until a hold placed now would be filled: the holds ahead of it divided by the rate
+    the queue has been served, taken as the drops in its hold count per day of history (new
+    holds hide some of them, so this errs long), or by copies per loan period until the
+    queue has been seen to move. None if there is nothing to go on.
+    """
+    if holds is None:
+        return None
+    if holds == 0 and re.search(r'\bavailable\b', availability_status, flags=re.IGNORECASE):
+        return 0.0
+    now = now or time.time()
+    served = sum(max(before - after, 0) for (_, before), (_, after) in zip(history, history[1:]))
+    history_days = (now - history[0][0]) / DAY if history else 0
+    if served and history_days >= 1:
+        served_per_day = served / history_days
+    elif copies:
+        served_per_day = copies / LOAN_PERIOD_DAYS
+    else:
+        return None
+    return (holds + 1) / served_per_day
+
+
+def check_page(state: WatchState, search_url: str, query_title: str, query_author: str, timeout: float=None) -> list:
+    """ fetch one library search (revalidating the cached page if possible) and return its changed holdings """
+    content = get_response_content(search_url, timeout=timeout)
+    content_hash = hashlib.sha256(content).hexdigest()
+    if state.is_unchanged(search_url, content_hash):
+        return []
+
+    df_results = bibliocommons.parse_results(content, title_refilter=query_title, author_refilter=query_author)
+    library = bibliocommons.extract_library_subdomain(search_url)
+    changes = state.update_page(search_url, library, content_hash, get_holdings(df_results))
+    return [x | {'wait_days': estimate_wait_days(state.get_hold_history(x['holding_key']), x['holds'], x['copies'], x['availability_status'])}
+            for x in changes]
+
+
+def check_watchlist(queries: pd.DataFrame, state: WatchState, libraries: list=None, concurrency: int=DEFAULT_CONCURRENCY, timeout: float=None) -> pd.DataFrame:
+    """ check every book (title and author columns) at every library and return the changed holdings """
+    pages = [(search_url, x.title, x.author)
+             for x in queries.itertuples()
+             for search_url in bibliocommons.compose_search_urls(title=x.title, author=x.author, libraries=libraries)]
+
+    changes = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(check_page, state, *x, timeout=timeout): x for x in pages}
+        for future in as_completed(futures):
+            search_url, title, _ = futures[future]
+            try:
+                changes.extend(future.result())
+            except Exception as e:
+                # the page keeps its last holdings and is checked again next round
+                print(f'{bibliocommons.extract_library_subdomain(search_url)}: {title} failed: {e}', file=sys.stderr)
+
+    columns = ['library', 'title', 'author', 'format', 'change', 'availability_status', 'holds', 'copies', 'wait_days']
+    return pd.DataFrame(changes, columns=[*columns, 'holding_key'])[columns]
+
+
+def watch(
+    watchlist_path: Path,
+    state: WatchState,
+    libraries: list=None,
+    interval_seconds: float=DEFAULT_INTERVAL_SECONDS,
+    rounds: int=None,
+    concurrency: int=DEFAULT_CONCURRENCY,
+    timeout: float=None,
+):
+    """
+    Check the watchlist every `interval_seconds` (forever, or `rounds` times), yielding the
+    changed holdings of each round. The watchlist is read again every round so it can be edited.
+    """
+    from tools.batch import read_queries
+
+    round_number = 0
+    while rounds is None or round_number < rounds:
+        started = time.time()
+        try:
+            queries = read_queries(watchlist_path)
+            df_changes = check_watchlist(queries, state, libraries=libraries, concurrency=concurrency, timeout=timeout)
+        except Exception as e:
+            # e.g. the watchlist is being edited: try again next round
+            print(f'round failed: {e!r}', file=sys.stderr)
+            df_changes = None
+        if df_changes is not None:
+            yield df_changes
+        round_number += 1
+        if rounds is None or round_number < rounds:
+            next_check = started + interval_seconds
+            print(f"next check at {time.strftime('%H:%M', time.localtime(next_check))}", file=sys.stderr)
+            time.sleep(max(next_check - time.time(), 0))
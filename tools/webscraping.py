@@ -1,12 +1,89 @@
+import os
 import re
+import json
+import threading
+import importlib.util
+from functools import reduce
+from operator import and_
+from typing import Literal
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from tools.cache import get_cache
+from tools.archive import archive_response
+import tools.metrics as metrics
+from tools.scheduler import RequestScheduler, get_scheduler
 
-def refilter(full_string, search_string):
-    """ ensure all words in search_string appear in full_string """
-    if search_string:
-        search_words = re.findall(r'\w+', search_string)
-        return all(w.lower() in full_string.lower() for w in search_words)
-    else:
-        return True
+# urllib3 only decodes brotli responses when one of these packages is installed
+try:
+    import brotli
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    try:
+        import brotlicffi
+        ACCEPT_ENCODING = 'gzip, deflate, br'
+    except ImportError:
+        ACCEPT_ENCODING = 'gzip, deflate'
+
+DEFAULT_POOL_CONNECTIONS = 10 # number of hosts to keep a connection pool for
+DEFAULT_POOL_MAXSIZE = 10 # number of connections kept alive per host
+DEFAULT_TIMEOUT_SECONDS = 30
+
+# BeautifulSoup tree builders in order of preference (fastest first)
+PARSER_BACKENDS = {
+    'lxml': 'lxml',
+    'html.parser': None, # part of the standard library so always available
+}
+
+REFILTER_MODES = Literal['all', 'strict', 'fuzzy']
+DEFAULT_FUZZY_THRESHOLD = 0.75
+
+
+def refilter_mask(candidates, search_string: str, mode: REFILTER_MODES='all', fuzzy_threshold: float=DEFAULT_FUZZY_THRESHOLD):
+    """
+    A boolean Series marking the candidate strings that match search_string (all at once).
+    'all': every word appears, 'strict': the words appear together as a phrase,
+    'fuzzy': at least `fuzzy_threshold` of the words appear
+    """
+    import pandas as pd
+
+    search_words = re.findall(r'\w+', (search_string or '').lower())
+    if not search_words:
+        return pd.Series(True, index=candidates.index)
+
+    candidates_lower = candidates.fillna('').astype('str').str.lower()
+    if mode == 'strict':
+        return candidates_lower.str.replace(r'\W+', ' ', regex=True).str.contains(' '.join(search_words), regex=False)
+
+    word_matches = [candidates_lower.str.contains(w, regex=False) for w in search_words]
+    if mode == 'fuzzy':
+        return sum(x.astype('int') for x in word_matches) / len(search_words) >= fuzzy_threshold
+    return reduce(and_, word_matches)
+
+
+def available_parser_backends() -> list:
+    return [name for name, module in PARSER_BACKENDS.items() if module is None or importlib.util.find_spec(module)]
+
+
+_parser_backend = os.environ.get('BOOKSEARCH_PARSER')
+
+
+def get_parser_backend() -> str:
+    """ get the backend set with set_parser_backend (or $BOOKSEARCH_PARSER), else the fastest one installed """
+    return _parser_backend or available_parser_backends()[0]
+
+
+def set_parser_backend(backend: str=None) -> None:
+    """ make every source parse with `backend`, or go back to the fastest installed one if None """
+    global _parser_backend
+    if backend is not None and backend not in available_parser_backends():
+        raise ValueError(f'{backend} is not an installed parser backend, choose from {available_parser_backends()}')
+    _parser_backend = backend
+
+
+def make_soup(content, parse_only=None, backend: str=None):
+    """ parse html with the selected backend; `parse_only` takes a SoupStrainer to build just part of the tree """
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(content, features=backend or get_parser_backend(), parse_only=parse_only)
 
 
 def get_text(elem) -> str:
@@ -14,9 +91,116 @@ def get_text(elem) -> str:
     return elem.getText() if elem else ''
 
 
-def get_response_content(search_url: str) -> bytes:
-    response = requests.get(search_url)
-    results_html = response.content
-    return results_html
+def explode_records(series):
+    """
+    Expand a series of lists of dicts into a frame with one row per dict, keeping the index of
+    the list each came from (empty lists keep one empty row). Same as .explode().apply(pd.Series)
+    but the frame is built from all the records at once instead of one Series per row.
+    """
+    import pandas as pd
+    index, records = [], []
+    for i, x in series.items():
+        for record in (x if isinstance(x, list) and x else [{}]):
+            index.append(i)
+            records.append(record)
+    return pd.DataFrame(records, index=pd.Index(index, name=series.index.name, dtype=series.index.dtype))
+
+
+class HttpClient:
+    """
+    A keep-alive HTTP client with a connection pool per host, shared by every source.
+    Pass `transport` (any requests adapter) to replace the network, e.g. to run offline.
+    Requests go through `scheduler` (default: the shared one) for rate limits and retries.
+    """
+
+    def __init__(
+        self,
+        pool_connections: int=DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize: int=DEFAULT_POOL_MAXSIZE,
+        timeout: float=DEFAULT_TIMEOUT_SECONDS,
+        transport: BaseAdapter=None,
+        headers: dict=None,
+        scheduler: RequestScheduler=None,
+    ):
+        self.timeout = timeout
+        self.scheduler = scheduler
+        self.session = requests.Session()
+        self.session.headers.update({'Accept-Encoding': ACCEPT_ENCODING} | (headers or {}))
+        adapter = transport or HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url: str, timeout: float=None, **kwargs) -> requests.Response:
+        """ get `url`, raising FetchError if it still fails after retrying """
+        scheduler = self.scheduler or get_scheduler()
+        return scheduler.send(url, lambda: self.session.get(url, timeout=timeout or self.timeout, **kwargs))
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    """ get the shared client, creating it with default settings on first use """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+
+
+def configure_client(**kwargs) -> HttpClient:
+    """ replace the shared client with one built from `kwargs` (see HttpClient) """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = HttpClient(**kwargs)
+        return _client
+
+
+def get_response_content(search_url: str, timeout: float=None) -> bytes:
+    """
+    Get the content at `search_url`, answering from the response cache when possible. An
+    expired entry with a validator is revalidated with a conditional request and reused if
+    the server answers 304 Not Modified.
+    """
+    with metrics.timed('fetch'):
+        cache = get_cache()
+        if cache and (cached_content := cache.get(search_url)) is not None:
+            metrics.add('cache_hits')
+            archive_response(search_url, cached_content)
+            return cached_content
+        metrics.add('cache_misses')
+
+        stale = cache.get_validators(search_url) if cache else None
+        conditional_headers = {}
+        if stale and stale['etag']:
+            conditional_headers['If-None-Match'] = stale['etag']
+        if stale and stale['last_modified']:
+            conditional_headers['If-Modified-Since'] = stale['last_modified']
+
+        response = get_client().get(search_url, timeout=timeout, headers=conditional_headers)
+        metrics.add('requests')
+        metrics.add('http_wait_seconds', response.elapsed.total_seconds()) # until the headers arrived: dns, connecting and the server
+        if stale and response.status_code == 304:
+            metrics.add('not_modified')
+            cache.revalidate(search_url)
+            archive_response(search_url, stale['content'], status=304, headers=dict(response.headers))
+            return stale['content']
+
+        results_html = response.content
+        metrics.add('bytes_downloaded', int(response.headers.get('Content-Length') or len(results_html))) # compressed size if given
+        archive_response(search_url, results_html, status=response.status_code, headers=dict(response.headers))
+        if cache and response.status_code == 200:
+            cache.set(search_url, results_html, etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
+        return results_html
+
+
+def get_response_json(search_url: str, timeout: float=None) -> dict:
+    return json.loads(get_response_content(search_url, timeout=timeout))
 
 